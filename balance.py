@@ -0,0 +1,135 @@
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import argparse
+import collections
+import itertools
+import multiprocessing
+import time
+
+import numpy as np
+import pygame
+
+import main as game_module
+
+KITE_DISTANCE = 200
+
+
+def kite_and_shoot(frame, game):
+    player_x, player_y = game.player.rect.center
+    count = len(game.enemies)
+    if not count:
+        return (pygame.K_SPACE,), (game.WIDTH // 2 + 100, game.HEIGHT // 2), ()
+    swarm = game.enemies
+    offsets = swarm.position[:count] + swarm.size[:count] / 2 - (player_x, player_y)
+    distances = np.maximum(np.hypot(offsets[:, 0], offsets[:, 1]), 1)
+    nearest = int(np.argmin(distances))
+    target_x, target_y = offsets[nearest] if distances[nearest] > 1 else (1, 0)
+    mouse_pos = (game.WIDTH // 2 + target_x, game.HEIGHT // 2 + target_y)
+
+    keys = [pygame.K_SPACE]
+    close = distances < KITE_DISTANCE
+    if close.any():
+        away_x, away_y = -(offsets[close] / distances[close, None] ** 2).sum(axis=0)
+        scale = max(abs(away_x), abs(away_y))
+        if away_x > scale / 2:
+            keys.append(pygame.K_d)
+        elif away_x < -scale / 2:
+            keys.append(pygame.K_a)
+        if away_y > scale / 2:
+            keys.append(pygame.K_s)
+        elif away_y < -scale / 2:
+            keys.append(pygame.K_w)
+    return keys, mouse_pos, ()
+
+
+def simulate(job):
+    config_dir, weapon, wave_stats, seed, duration = job
+    game_module.CONFIG = game_module.ConfigRegistry.load(config_dir)
+    game_module.set_clock(game_module.VirtualClock(game_module.Game.STEP_DURATION))
+    game_module.RNG.seed(seed)
+    game = game_module.Game(game_module.ScriptedInput(kite_and_shoot))
+    game.WAVE_ADDITIONAL_STATS = wave_stats
+    game.player.current_weapon = next(item for item in game.player.weapons if item.name == weapon)
+
+    steps = int(duration // game.STEP_DURATION)
+    start = time.perf_counter()
+    for step in range(steps):
+        game.input.next_frame(game)
+        game.event_handler()
+        if game.state != 'running':
+            break
+        game.advance(1, render=False)
+    else:
+        step = steps
+    elapsed = time.perf_counter() - start
+
+    game_time = game_module.CLOCK.get_ticks()
+    return {
+        'config': config_dir,
+        'weapon': weapon,
+        'wave_stats': wave_stats,
+        'seed': seed,
+        'kills': game.player.kills,
+        'time_to_death': game_time if game.player.current_hp <= 0 else None,
+        'dps': game.player.current_weapon.damage_dealt * 1000 / max(game_time, 1),
+        'frame_ms': elapsed * 1000 / max(step, 1),
+    }
+
+
+def summarize(results):
+    groups = collections.defaultdict(list)
+    for result in results:
+        groups[(result['config'], result['weapon'], result['wave_stats'])].append(result)
+    print(f"{'config':<12}{'weapon':<14}{'wave stats':>11}{'runs':>6}{'kills':>9}{'died':>7}{'death s':>9}"
+          f"{'dps':>9}{'frame ms':>10}")
+    for (config_dir, weapon, wave_stats), group in sorted(groups.items()):
+        deaths = [result['time_to_death'] for result in group if result['time_to_death'] is not None]
+        death_time = f"{np.mean(deaths) / 1000:.1f}" if deaths else '-'
+        print(f"{config_dir:<12}{weapon:<14}{wave_stats:>11.2f}{len(group):>6}"
+              f"{np.mean([result['kills'] for result in group]):>9.1f}{len(deaths) / len(group):>7.0%}{death_time:>9}"
+              f"{np.mean([result['dps'] for result in group]):>9.1f}"
+              f"{np.mean([result['frame_ms'] for result in group]):>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run headless games with a kiting AI player across a process pool '
+                                                 'and report balance statistics.')
+    parser.add_argument('--runs', type=int, default=8, help='seeds per config, weapon and wave stats combination')
+    parser.add_argument('--config', action='append', help='config directory to load (default: Const)')
+    parser.add_argument('--weapon', action='append', help='weapon to test (default: all)')
+    parser.add_argument('--wave-stats', action='append', type=float,
+                        help=f"stat increase per wave (default: {game_module.Game.WAVE_ADDITIONAL_STATS})")
+    parser.add_argument('--duration', type=float, help='game time per run in ms (default: all waves)')
+    parser.add_argument('--processes', type=int, help='worker processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    wave_stats = args.wave_stats or [game_module.Game.WAVE_ADDITIONAL_STATS]
+    jobs = []
+    for config_dir in args.config or ['Const']:
+        try:
+            registry = game_module.ConfigRegistry.load(config_dir)
+        except (OSError, ValueError) as error:
+            parser.error(f"cannot load config {config_dir!r}: {error}")
+        available = [name for name in game_module.Player.WEAPONS if name in registry.weapons]
+        for weapon in args.weapon or []:
+            if weapon not in available:
+                parser.error(f"weapon {weapon!r} is not available in {config_dir} (choose from {', '.join(available)})")
+        duration = args.duration or sum(wave.duration for wave in registry.waves)
+        jobs.extend((config_dir, weapon, stats, seed, duration)
+                    for weapon, stats in itertools.product(args.weapon or available, wave_stats)
+                    for seed in range(args.runs))
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.map(simulate, jobs, chunksize=1)
+        # SDL traps SIGTERM in the workers, so let them exit on their own before the pool terminates them
+        pool.close()
+        pool.join()
+    summarize(results)
+    print(f"\n{len(jobs)} runs in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import argparse
+import math
+
+import numpy as np
+import pygame
+
+import main as game_module
+
+SCENARIOS = {
+    'idle': {'enemies': 0, 'weapon': 'default'},
+    '200 enemies + flamethrower spam': {'enemies': 200, 'weapon': 'flamethrower'},
+    '200 enemies + sniper bounce': {'enemies': 200, 'weapon': 'sniper'},
+    '200 enemies + spinner chain': {'enemies': 200, 'weapon': 'spinner'},
+    '2000 enemies + flamethrower spam': {'enemies': 2000, 'weapon': 'flamethrower'},
+}
+
+
+def aim_and_shoot(frame, game):
+    angle = frame * 0.05
+    mouse_pos = (game.WIDTH // 2 + math.cos(angle) * 200, game.HEIGHT // 2 + math.sin(angle) * 200)
+    return (pygame.K_SPACE,), mouse_pos, ()
+
+
+def setup_scenario(enemies, weapon, seed):
+    game_module.set_clock(game_module.VirtualClock(game_module.Game.STEP_DURATION))
+    game_module.RNG.seed(seed)
+    game = game_module.Game(game_module.ScriptedInput(aim_and_shoot))
+    game.SPAWN_LIMIT = max(game.SPAWN_LIMIT, enemies)
+    game.player.current_weapon = next(item for item in game.player.weapons if item.name == weapon)
+    for _ in range(enemies):
+        angle = game_module.RNG.uniform(0, 2 * math.pi)
+        distance = game_module.RNG.uniform(game.HEIGHT * 0.3, game.WIDTH * 0.7)
+        game.create_enemy(game.player.rect.centerx + math.cos(angle) * distance,
+                          game.player.rect.centery + math.sin(angle) * distance)
+    return game
+
+
+def run_scenario(enemies, weapon, frames, seed):
+    game = setup_scenario(enemies, weapon, seed)
+    game.profiler = game_module.FrameProfiler(game.STAGES, history=frames)
+    for frame in range(frames):
+        # keep the player alive so every scenario runs the full frame count; contact damage is still computed
+        game.player.current_hp = game.player.max_hp
+        game.input.next_frame(game)
+        game.event_handler()
+        if game.state != 'running':
+            raise RuntimeError(f"scenario stopped after {frame} of {frames} frames (state {game.state!r})")
+        game.advance(1)
+    return game
+
+
+def report(name, game):
+    profiler = game.profiler
+    durations = profiler.stage_durations()
+    means = [*np.nanmean(durations, axis=0).tolist(), np.nansum(durations, axis=1).mean()]
+    print(f"\n{name}: {profiler.frame} frames, {len(game.enemies)} enemies, {len(game.player.bullets)} bullets, "
+          f"{game.player.kills} kills")
+    print(f"  {'stage':<24}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for mean, (stage, (p50, p99)) in zip(means, profiler.percentiles(50, 99).items()):
+        print(f"  {stage:<24}{mean:>10.3f}{p50:>10.3f}{p99:>10.3f}")
+    print('  pools (hits/misses): ' + ', '.join(f"{name} {hits}/{misses}"
+                                              for name, (hits, misses) in game.pool_stats().items() if hits or misses))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run headless gameplay scenarios and report per-system timings.')
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='scenario to run (default: all)')
+    args = parser.parse_args()
+    for name in args.scenario or SCENARIOS:
+        game = run_scenario(frames=args.frames, seed=args.seed, **SCENARIOS[name])
+        report(name, game)
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
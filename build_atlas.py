@@ -0,0 +1,73 @@
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import argparse
+import json
+
+import pygame
+
+from main import AssetCache
+
+PADDING = 1
+
+
+def pack(sizes, page_size):
+    # shelf packing: tallest images first, left to right, a new shelf when a row is full
+    placements = {}
+    page, shelf_x, shelf_y, shelf_height = 0, 0, 0, 0
+    for path in sorted(sizes, key=lambda item: (-sizes[item][1], -sizes[item][0], item)):
+        width, height = sizes[path]
+        if width > page_size or height > page_size:
+            raise ValueError(f"{path} ({width}x{height}) does not fit on a {page_size}x{page_size} atlas page")
+        if shelf_x + width > page_size:
+            shelf_x, shelf_y, shelf_height = 0, shelf_y + shelf_height, 0
+        if shelf_y + height > page_size:
+            page, shelf_x, shelf_y, shelf_height = page + 1, 0, 0, 0
+        placements[path] = (page, shelf_x, shelf_y, width, height)
+        shelf_x += width + PADDING
+        shelf_height = max(shelf_height, height + PADDING)
+    return placements
+
+
+def build(page_size):
+    pygame.display.set_mode((1, 1))
+    images = {path: pygame.image.load(path).convert_alpha() for path in AssetCache.asset_paths()}
+    placements = pack({path: image.get_size() for path, image in images.items()}, page_size)
+    page_count = max((page for page, *_ in placements.values()), default=-1) + 1
+    pages = []
+    for page in range(page_count):
+        frames = [frame for frame in placements.values() if frame[0] == page]
+        surface = pygame.Surface((max(x + width for _, x, _, width, _ in frames),
+                                  max(y + height for _, _, y, _, height in frames)), pygame.SRCALPHA)
+        for path, (frame_page, x, y, _, _) in placements.items():
+            if frame_page == page:
+                surface.blit(images[path], (x, y), special_flags=pygame.BLEND_RGBA_MAX)
+        pages.append(surface)
+
+    os.makedirs(AssetCache.ATLAS_DIR, exist_ok=True)
+    index = {'pages': [], 'frames': {}}
+    for page, surface in enumerate(pages):
+        name = f"atlas_{page}.png"
+        pygame.image.save(surface, os.path.join(AssetCache.ATLAS_DIR, name))
+        index['pages'].append(name)
+    for path, frame in sorted(placements.items()):
+        index['frames'][path.replace(os.sep, '/')] = frame
+    with open(AssetCache.ATLAS_INDEX, 'w') as fd:
+        json.dump(index, fd)
+    return index, pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack every PNG under Assets/ into atlas pages with a JSON index.')
+    parser.add_argument('--page-size', type=int, default=2048, help='maximum atlas page width and height')
+    args = parser.parse_args()
+    index, pages = build(args.page_size)
+    print(f"packed {len(index['frames'])} images into {len(pages)} pages: "
+          + ', '.join(f"{name} {surface.get_width()}x{surface.get_height()}"
+                      for name, surface in zip(index['pages'], pages)))
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,19 @@
 import pygame
+import numpy as np
 
 import os
+import io
 import random
 import json
-import copy
 import math
+import dataclasses
+import types
+import time
+import concurrent.futures
+import heapq
+import itertools
+import struct
+import warnings
 
 pygame.font.init()
 pygame.display.set_caption('My game')
@@ -15,6 +24,478 @@ RED = (255, 0, 0)
 FPS = 60
 
 
+class RealClock:
+    def __init__(self):
+        self.clock = pygame.time.Clock()
+
+    def get_ticks(self):
+        return pygame.time.get_ticks()
+
+    def tick(self, framerate):
+        return self.clock.tick(framerate)
+
+
+class VirtualClock:
+    def __init__(self, frame_duration=1000 / FPS):
+        self.frame_duration = frame_duration
+        self.ticks = 0
+
+    def get_ticks(self):
+        return int(self.ticks)
+
+    def tick(self, framerate=None):
+        duration = 1000 / framerate if framerate else self.frame_duration
+        self.ticks += duration
+        return duration
+
+
+# game time only advances in fixed simulation steps; RealClock paces the frames in run()
+CLOCK = VirtualClock()
+RNG = random.Random()
+
+
+def set_clock(clock):
+    global CLOCK
+    CLOCK = clock
+
+
+class LiveInput:
+    def next_frame(self, game):
+        pass
+
+    def get_pressed(self):
+        return pygame.key.get_pressed()
+
+    def get_mouse_pos(self):
+        return pygame.mouse.get_pos()
+
+    def get_mouse_pressed(self):
+        return pygame.mouse.get_pressed()
+
+    def get_events(self):
+        return pygame.event.get()
+
+
+class KeyState:
+    def __init__(self, keys=()):
+        self.keys = frozenset(keys)
+
+    def __getitem__(self, key):
+        return key in self.keys
+
+
+class ScriptedInput:
+    def __init__(self, script=None):
+        self.script = script
+        self.frame = 0
+        self.keys = KeyState()
+        self.mouse_pos = (0, 0)
+        self.events = []
+
+    def next_frame(self, game):
+        if self.script is not None:
+            keys, self.mouse_pos, events = self.script(self.frame, game)
+            self.keys = KeyState(keys)
+            self.events.extend(events)
+        self.frame += 1
+
+    def get_pressed(self):
+        return self.keys
+
+    def get_mouse_pos(self):
+        return self.mouse_pos
+
+    def get_mouse_pressed(self):
+        return False, False, False
+
+    def get_events(self):
+        events, self.events = self.events, []
+        return events
+
+
+class InputRecording:
+    MAGIC = b'RPLY'
+    VERSION = 1
+    HEADER = struct.Struct('<4sBq')
+    FRAME = struct.Struct('<dHhhBB')
+    EVENT = struct.Struct('<Bi')
+    TRACKED_KEYS = (pygame.K_a, pygame.K_d, pygame.K_w, pygame.K_s, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP,
+                    pygame.K_DOWN, pygame.K_SPACE)
+    EVENT_TYPES = (pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEWHEEL)
+
+    @classmethod
+    def pack_event(cls, event):
+        kind = cls.EVENT_TYPES.index(event.type)
+        if event.type == pygame.KEYDOWN:
+            return cls.EVENT.pack(kind, event.key)
+        if event.type == pygame.MOUSEWHEEL:
+            return cls.EVENT.pack(kind, event.y)
+        return cls.EVENT.pack(kind, 0)
+
+    @classmethod
+    def unpack_event(cls, kind, value):
+        event_type = cls.EVENT_TYPES[kind]
+        if event_type == pygame.KEYDOWN:
+            return pygame.event.Event(event_type, key=value)
+        if event_type == pygame.MOUSEWHEEL:
+            return pygame.event.Event(event_type, x=0, y=value)
+        return pygame.event.Event(event_type)
+
+
+class InputRecorder(InputRecording):
+    def __init__(self, source, clock, path, seed):
+        self.source = source
+        self.clock = clock
+        self.fd = open(path, 'wb')
+        self.fd.write(self.HEADER.pack(self.MAGIC, self.VERSION, seed))
+        self.frame_duration = 0
+        self.keys = KeyState()
+        self.mouse_pos = (0, 0)
+        self.mouse_pressed = (False, False, False)
+        self.events = []
+
+    def get_ticks(self):
+        return self.clock.get_ticks()
+
+    def tick(self, framerate=None):
+        self.frame_duration = self.clock.tick(framerate)
+        return self.frame_duration
+
+    def next_frame(self, game):
+        self.source.next_frame(game)
+        pressed = self.source.get_pressed()
+        tracked = [bool(pressed[key]) for key in self.TRACKED_KEYS]
+        self.keys = KeyState(key for key, down in zip(self.TRACKED_KEYS, tracked) if down)
+        self.mouse_pos = tuple(int(coord) for coord in self.source.get_mouse_pos())
+        self.mouse_pressed = tuple(bool(button) for button in self.source.get_mouse_pressed()[:3])
+        self.events = [event for event in self.source.get_events() if event.type in self.EVENT_TYPES]
+        # one write per frame, so an interrupt never leaves half a frame in the file
+        self.fd.write(self.FRAME.pack(self.frame_duration, sum(down << bit for bit, down in enumerate(tracked)),
+                                      *self.mouse_pos, sum(down << bit for bit, down in enumerate(self.mouse_pressed)),
+                                      len(self.events)) +
+                      b''.join(self.pack_event(event) for event in self.events))
+
+    def get_pressed(self):
+        return self.keys
+
+    def get_mouse_pos(self):
+        return self.mouse_pos
+
+    def get_mouse_pressed(self):
+        return self.mouse_pressed
+
+    def get_events(self):
+        events, self.events = self.events, []
+        return events
+
+    def close(self):
+        self.fd.close()
+
+
+class ReplayInput(InputRecording):
+    def __init__(self, path):
+        with open(path, 'rb') as fd:
+            data = fd.read()
+        magic, version, self.seed = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f"{path}: not a version {self.VERSION} input recording")
+        self.frames = []
+        offset = self.HEADER.size
+        while offset < len(data):
+            frame_duration, key_bits, mouse_x, mouse_y, button_bits, event_count = self.FRAME.unpack_from(data, offset)
+            offset += self.FRAME.size
+            events = []
+            for _ in range(event_count):
+                events.append(self.EVENT.unpack_from(data, offset))
+                offset += self.EVENT.size
+            self.frames.append((frame_duration,
+                                KeyState(key for bit, key in enumerate(self.TRACKED_KEYS) if key_bits >> bit & 1),
+                                (mouse_x, mouse_y),
+                                tuple(bool(button_bits >> bit & 1) for bit in range(3)),
+                                events))
+        self.frame = 0
+        self.ticks = 0
+        self.keys = KeyState()
+        self.mouse_pos = (0, 0)
+        self.mouse_pressed = (False, False, False)
+        self.events = []
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get_ticks(self):
+        return self.ticks
+
+    def tick(self, framerate=None):
+        frame_duration = self.frames[self.frame][0]
+        self.ticks += frame_duration
+        return frame_duration
+
+    def next_frame(self, game):
+        _, self.keys, self.mouse_pos, self.mouse_pressed, events = self.frames[self.frame]
+        self.events = [self.unpack_event(kind, value) for kind, value in events]
+        self.frame += 1
+
+    def get_pressed(self):
+        return self.keys
+
+    def get_mouse_pos(self):
+        return self.mouse_pos
+
+    def get_mouse_pressed(self):
+        return self.mouse_pressed
+
+    def get_events(self):
+        events, self.events = self.events, []
+        return events
+
+
+@dataclasses.dataclass(frozen=True)
+class WeaponConfig:
+    name: str
+    damage: float
+    cooldown: float
+    pierce: bool
+    chain: bool
+    bounce: bool
+    bullet_speed: float
+    bullet_duration: float
+    spread: float
+    weapon_img: str
+    bullet_img: str = None
+    bullet_rotate: bool = False
+    weapon_spin: bool = False
+    bullet_spin: bool = False
+    lifesteal: float = None
+    pool_capacity: int = 64
+
+
+@dataclasses.dataclass(frozen=True)
+class EnemyConfig:
+    name: str
+    hp: float
+    move_speed: float
+    damage: float
+    image_path: str
+    is_boss: bool = False
+    pool_capacity: int = 64
+
+
+@dataclasses.dataclass(frozen=True)
+class WaveConfig:
+    enemies: tuple
+    spawnrates: tuple
+    boss: tuple
+    duration: float = 60000
+
+
+class ConfigRegistry:
+    def __init__(self, weapons, enemies, bosses, waves):
+        self.weapons = types.MappingProxyType(weapons)
+        self.enemies = types.MappingProxyType(enemies)
+        self.bosses = types.MappingProxyType(bosses)
+        self.waves = tuple(waves)
+        self.enemy_types = tuple(enemies)
+        self.boss_types = tuple(bosses)
+
+    @classmethod
+    def load(cls, directory='Const'):
+        weapons = cls.read_records(os.path.join(directory, 'weapons.json'), WeaponConfig)
+        enemies = cls.read_records(os.path.join(directory, 'enemies.json'), EnemyConfig, is_boss=False)
+        bosses = cls.read_records(os.path.join(directory, 'bosses.json'), EnemyConfig, is_boss=True)
+        waves_path = os.path.join(directory, 'waves.json')
+        with open(waves_path) as fd:
+            waves_data = json.load(fd)
+        if not isinstance(waves_data, list) or not waves_data:
+            raise ValueError(f"{waves_path}: expected a non-empty list of waves")
+        waves = [cls.build_record(WaveConfig, wave, f"{waves_path}[{wave_id}]")
+                 for wave_id, wave in enumerate(waves_data)]
+
+        for weapon in weapons.values():
+            cls.check_file(weapon.weapon_img, f"weapon {weapon.name}")
+            if weapon.bullet_img is not None:
+                cls.check_file(weapon.bullet_img, f"weapon {weapon.name}")
+        for weapon in weapons.values():
+            if weapon.pool_capacity < 0:
+                raise ValueError(f"weapon {weapon.name}: pool_capacity must not be negative")
+        for enemy in (*enemies.values(), *bosses.values()):
+            if not os.path.isdir(enemy.image_path):
+                raise ValueError(f"{enemy.name}: image_path {enemy.image_path!r} is not a directory")
+            if enemy.pool_capacity < 0:
+                raise ValueError(f"{enemy.name}: pool_capacity must not be negative")
+        for wave_id, wave in enumerate(waves):
+            where = f"{waves_path}[{wave_id}]"
+            if len(wave.enemies) != len(wave.spawnrates):
+                raise ValueError(f"{where}: 'enemies' and 'spawnrates' must have the same length")
+            for enemy_type in wave.enemies:
+                if enemy_type not in enemies:
+                    raise ValueError(f"{where}: unknown enemy {enemy_type!r}")
+            for boss_type in wave.boss:
+                if boss_type not in bosses:
+                    raise ValueError(f"{where}: unknown boss {boss_type!r}")
+            for spawnrate in wave.spawnrates:
+                if spawnrate <= 0:
+                    raise ValueError(f"{where}: spawnrates must be positive")
+            if wave.duration <= 0:
+                raise ValueError(f"{where}: duration must be positive")
+        return cls(weapons, enemies, bosses, waves)
+
+    @classmethod
+    def read_records(cls, path, record_type, **fixed):
+        with open(path) as fd:
+            data = json.load(fd)
+        if not isinstance(data, dict) or not data:
+            raise ValueError(f"{path}: expected a non-empty object keyed by name")
+        for name, attributes in data.items():
+            for key, value in fixed.items():
+                if isinstance(attributes, dict) and attributes.get(key, value) != value:
+                    raise ValueError(f"{path}: {name}: {key!r} must be {json.dumps(value)} in this file")
+        return {name: cls.build_record(record_type, {**attributes, **fixed, 'name': name}, f"{path}: {name}")
+                for name, attributes in data.items()}
+
+    @staticmethod
+    def build_record(record_type, data, where):
+        if not isinstance(data, dict):
+            raise ValueError(f"{where}: expected an object")
+        fields = {field.name: field for field in dataclasses.fields(record_type)}
+        for key in data:
+            if key not in fields:
+                raise ValueError(f"{where}: unknown key {key!r}")
+        values = {}
+        for name, field in fields.items():
+            if name not in data:
+                if field.default is dataclasses.MISSING:
+                    raise ValueError(f"{where}: missing key {name!r}")
+                continue
+            value = data[name]
+            if value is None and field.default is None:
+                pass
+            elif field.type is tuple:
+                if not isinstance(value, list):
+                    raise ValueError(f"{where}: {name!r} must be a list")
+                value = tuple(value)
+            elif field.type is float:
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    raise ValueError(f"{where}: {name!r} must be a number")
+            elif field.type is int:
+                if isinstance(value, bool) or not isinstance(value, int):
+                    raise ValueError(f"{where}: {name!r} must be an integer")
+            elif not isinstance(value, field.type):
+                raise ValueError(f"{where}: {name!r} must be of type {field.type.__name__}")
+            values[name] = value
+        return record_type(**values)
+
+    @staticmethod
+    def check_file(path, where):
+        if not os.path.isfile(path):
+            raise ValueError(f"{where}: image {path!r} does not exist")
+
+
+CONFIG = ConfigRegistry.load()
+
+
+class AssetCache:
+    ROTATION_STEPS = 128
+    ASSET_DIR = 'Assets'
+    ATLAS_DIR = os.path.join(ASSET_DIR, 'atlas')
+    ATLAS_INDEX = os.path.join(ATLAS_DIR, 'index.json')
+    LOADER_THREADS = 4
+    images = {}
+    walk_frames = {}
+    rotations = {}
+
+    @classmethod
+    def image(cls, path, variant=None):
+        path = os.path.normpath(path)
+        key = (path, variant)
+        if key not in cls.images:
+            if variant is None:
+                cls.images[key] = pygame.image.load(path).convert_alpha()
+            elif variant == 'flipped':
+                cls.images[key] = pygame.transform.flip(cls.image(path), flip_x=True, flip_y=False)
+            else:
+                raise KeyError(f"Unknown image variant {variant!r}")
+        return cls.images[key]
+
+    @classmethod
+    def walk(cls, image_path, type_, variant=None):
+        key = (image_path, type_, variant)
+        if key not in cls.walk_frames:
+            if variant is None:
+                frame_path = f"{image_path}/{type_}_Walk_{{}}.png"
+            else:
+                frame_path = f"{image_path}/Variant{variant}/{type_}_Walk_{{}}.png"
+            right = tuple(cls.image(frame_path.format(img_id)) for img_id in range(Enemy.WALK_ANIMATION_FRAMES))
+            left = tuple(cls.image(frame_path.format(img_id), 'flipped') for img_id in range(Enemy.WALK_ANIMATION_FRAMES))
+            cls.walk_frames[key] = (right, left)
+        return cls.walk_frames[key]
+
+    @classmethod
+    def rotated(cls, image, angle):
+        rotations = cls.rotations.get(image)
+        if rotations is None:
+            rotations = cls.rotations[image] = [None] * cls.ROTATION_STEPS
+        step = round(angle * cls.ROTATION_STEPS / 360) % cls.ROTATION_STEPS
+        rotated_image = rotations[step]
+        if rotated_image is None:
+            rotated_image = rotations[step] = pygame.transform.rotate(image, step * 360 / cls.ROTATION_STEPS)
+        return rotated_image
+
+    @classmethod
+    def asset_paths(cls):
+        paths = []
+        for root, dirs, files in os.walk(cls.ASSET_DIR):
+            dirs[:] = [name for name in dirs if os.path.join(root, name) != cls.ATLAS_DIR]
+            paths.extend(os.path.normpath(os.path.join(root, name)) for name in files if name.lower().endswith('.png'))
+        return sorted(paths)
+
+    @staticmethod
+    def decode(path):
+        with open(path, 'rb') as fd:
+            return pygame.image.load(io.BytesIO(fd.read()), path)
+
+    @classmethod
+    def load_atlas_index(cls):
+        if not os.path.exists(cls.ATLAS_INDEX):
+            return [], {}
+        with open(cls.ATLAS_INDEX) as fd:
+            index = json.load(fd)
+        pages = [os.path.normpath(os.path.join(cls.ATLAS_DIR, page)) for page in index['pages']]
+        frames = {os.path.normpath(path): tuple(frame) for path, frame in index['frames'].items()}
+        return pages, frames
+
+    @classmethod
+    def load_all(cls, progress=None):
+        pages, frames = cls.load_atlas_index()
+        paths = [path for path in cls.asset_paths() if (path, None) not in cls.images and path not in frames]
+        if any((path, None) not in cls.images for path in frames):
+            paths = pages + paths
+        page_surfaces = {}
+        with concurrent.futures.ThreadPoolExecutor(cls.LOADER_THREADS) as executor:
+            futures = {executor.submit(cls.decode, path): path for path in paths}
+            for loaded, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                # convert_alpha needs the display, so it stays on the main thread
+                surface = future.result().convert_alpha()
+                if futures[future] in pages:
+                    page_surfaces[pages.index(futures[future])] = surface
+                else:
+                    cls.images[(futures[future], None)] = surface
+                if progress is not None:
+                    progress(loaded, len(paths))
+        for path, (page, x, y, width, height) in frames.items():
+            if page in page_surfaces:
+                cls.images[(path, None)] = page_surfaces[page].subsurface((x, y, width, height))
+        cls.preload()
+
+    @classmethod
+    def preload(cls):
+        for type_, attributes in CONFIG.enemies.items():
+            for variant in range(Enemy.VARIANTS):
+                cls.walk(attributes.image_path, type_, variant)
+        for type_, attributes in CONFIG.bosses.items():
+            cls.walk(attributes.image_path, type_)
+
+
 class Player:
     WIDTH, HEIGHT = 35, 35
     CLASSES = {
@@ -22,9 +503,10 @@ class Player:
     }
     IMMUNITY_FRAME_DURATION = 500
     WEAPON_COOLDOWN = 500
+    WEAPONS = ('sniper', 'flamethrower', 'default', 'spinner')
 
     def __init__(self, coord_x, coord_y, class_='default'):
-        self.image = pygame.image.load("Assets/Maxim_verylowres.png").convert_alpha()
+        self.image = AssetCache.image("Assets/Maxim_verylowres.png")
         self.kills = 0
         self.class_ = class_
         self.max_hp = self.CLASSES[class_]['hp']
@@ -33,12 +515,12 @@ class Player:
         self.move_speed = self.CLASSES[class_]['move_speed']
         self.rect = pygame.Rect(coord_x, coord_y, self.WIDTH, self.HEIGHT)
 
-        self.weapons = [Weapon('sniper'), Weapon('flamethrower'), Weapon('default'), Weapon('spinner')]
+        self.bullets = BulletPool(0)
+        self.weapons = [Weapon(name, self.bullets) for name in self.WEAPONS if name in CONFIG.weapons]
         self.current_weapon = self.weapons[0]
-        self.last_damage_taken_time = pygame.time.get_ticks()
+        self.last_damage_taken_time = CLOCK.get_ticks()
 
-    def input(self):
-        keys_pressed = pygame.key.get_pressed()
+    def input(self, keys_pressed):
         if keys_pressed[pygame.K_a] or keys_pressed[pygame.K_LEFT]:
             self.rect.x -= self.move_speed
         if keys_pressed[pygame.K_d] or keys_pressed[pygame.K_RIGHT]:
@@ -51,42 +533,43 @@ class Player:
             self.current_weapon.shoot()
 
     def draw(self, window, cam_offset):
-        window.blit(self.image, (self.rect.x + (Player.WIDTH - self.image.get_width()) // 2 - cam_offset[0],
-                                 self.rect.y + (Player.HEIGHT - self.image.get_height()) // 2 - cam_offset[1]))
-        self.current_weapon.draw(window, cam_offset)
+        player_rect = window.blit(self.image, (self.rect.x + (Player.WIDTH - self.image.get_width()) // 2 - cam_offset[0],
+                                              self.rect.y + (Player.HEIGHT - self.image.get_height()) // 2 - cam_offset[1]))
+        return [player_rect, self.current_weapon.draw(window, cam_offset)]
 
 
 class Weapon:
     DISTANCE_FROM_PLAYER = 15
 
-    with open('Const/weapons.json') as fd:
-        WEAPONS = json.load(fd)
-
-    def __init__(self, name):
-        if name in self.WEAPONS.keys():
+    def __init__(self, name, bullets):
+        if name in CONFIG.weapons:
+            stats = CONFIG.weapons[name]
             self.name = name
-            self.damage = self.WEAPONS[name]['damage']
-            self.cooldown = self.WEAPONS[name]['cooldown']
-            self.pierce = self.WEAPONS[name]['pierce']
-            self.chain = self.WEAPONS[name]['chain']
-            self.bounce = self.WEAPONS[name]['bounce']
-            self.bullet_speed = self.WEAPONS[name]['bullet_speed']
-            self.bullet_duration = self.WEAPONS[name]['bullet_duration']
-            self.bullet_spread = self.WEAPONS[name]['spread']
-            self.last_shoot_time = pygame.time.get_ticks()
-            self.image = pygame.image.load(self.WEAPONS[name]["weapon_img"]).convert_alpha()
-            self.weapon_spin = self.WEAPONS[name].get("weapon_spin")
-            self.bullet_spin = self.WEAPONS[name].get("bullet_spin")
-            self.lifesteal = self.WEAPONS[name].get("lifesteal")
-
-            if self.WEAPONS[name]["bullet_img"]:
-                self.bullet_image = pygame.image.load(self.WEAPONS[name]["bullet_img"]).convert_alpha()
-                self.bullet_rotate = self.WEAPONS[name]["bullet_rotate"]
+            self.damage = stats.damage
+            self.cooldown = stats.cooldown
+            self.pierce = stats.pierce
+            self.chain = stats.chain
+            self.bounce = stats.bounce
+            self.bullet_speed = stats.bullet_speed
+            self.bullet_duration = stats.bullet_duration
+            self.bullet_spread = stats.spread
+            self.last_shoot_time = CLOCK.get_ticks()
+            self.image = AssetCache.image(stats.weapon_img)
+            self.flipped_image = AssetCache.image(stats.weapon_img, 'flipped')
+            self.weapon_spin = stats.weapon_spin
+            self.bullet_spin = stats.bullet_spin
+            self.lifesteal = stats.lifesteal
+            self.damage_dealt = 0
+
+            if stats.bullet_img:
+                self.bullet_image = AssetCache.image(stats.bullet_img)
+                self.bullet_rotate = stats.bullet_rotate
             else:
                 self.bullet_image = None
                 self.bullet_rotate = False
 
-            self.bullets = []
+            self.bullets = bullets
+            self.weapon_id = bullets.register(self, stats.pool_capacity)
             self.current_image = self.image
             self.center_vector = pygame.Vector2(-100, -100)
             self.vector_to_mouse = pygame.Vector2(0, 0)
@@ -95,29 +578,28 @@ class Weapon:
     def shoot(self):
         spread_vector_left = self.vector_to_mouse.rotate_rad(self.bullet_spread)
         spread_vector_right = self.vector_to_mouse.rotate_rad(-self.bullet_spread)
-        after_spread_vector = random.random() * spread_vector_left + random.random() * spread_vector_right
+        after_spread_vector = RNG.random() * spread_vector_left + RNG.random() * spread_vector_right
         after_spread_vector.normalize_ip()
-        if pygame.time.get_ticks() - self.last_shoot_time >= self.cooldown:
-            self.last_shoot_time = pygame.time.get_ticks()
-            bullet = Bullet(self.center_vector.x, self.center_vector.y, after_spread_vector, speed=self.bullet_speed,
-                            damage=self.damage, bounce=self.bounce, chain=self.chain, pierce=self.pierce, image=self.bullet_image,
-                            duration=self.bullet_duration, rotate=self.bullet_rotate, spin=self.bullet_spin)
-            self.bullets.append(bullet)
-
-    def update_position(self, player_center_x, player_center_y, cam_offset):
-        self.vector_to_mouse = pygame.Vector2(pygame.mouse.get_pos()[0] - player_center_x + cam_offset[0],
-                                              pygame.mouse.get_pos()[1] - player_center_y + cam_offset[1])
+        if CLOCK.get_ticks() - self.last_shoot_time >= self.cooldown:
+            self.last_shoot_time = CLOCK.get_ticks()
+            self.bullets.spawn(self.center_vector.x, self.center_vector.y, after_spread_vector, self, self.last_shoot_time)
+
+    def update_position(self, player_center_x, player_center_y, cam_offset, mouse_pos):
+        self.vector_to_mouse = pygame.Vector2(mouse_pos[0] - player_center_x + cam_offset[0],
+                                              mouse_pos[1] - player_center_y + cam_offset[1])
         self.vector_to_mouse.normalize_ip()
         self.center_vector = pygame.Vector2(player_center_x, player_center_y) + self.vector_to_mouse * self.DISTANCE_FROM_PLAYER
 
         if self.vector_to_mouse.x > 0:
-            self.current_image = pygame.transform.rotate(self.image, self.vector_to_mouse.angle_to(pygame.Vector2(1,0)))
+            image = self.image
+            angle = self.vector_to_mouse.angle_to(pygame.Vector2(1, 0))
         else:
-            self.current_image = pygame.transform.flip(self.image, flip_x=True, flip_y=False)
-            self.current_image = pygame.transform.rotate(self.current_image, self.vector_to_mouse.angle_to(pygame.Vector2(-1, 0)))
+            image = self.flipped_image
+            angle = self.vector_to_mouse.angle_to(pygame.Vector2(-1, 0))
         if self.weapon_spin:
-            self.current_image = pygame.transform.rotate(self.current_image, self.rotate_angle)
+            angle += self.rotate_angle
             self.rotate_angle = (self.rotate_angle + 3) % 360
+        self.current_image = AssetCache.rotated(image, angle)
 
     def draw(self, window, cam_offset):
         if self.weapon_spin:
@@ -126,200 +608,883 @@ class Weapon:
         else:
             coord = (self.center_vector.x - self.image.get_width() / 2 - cam_offset[0],
                      self.center_vector.y - self.image.get_height() / 2 - cam_offset[1])
-        window.blit(self.current_image, coord)
+        return window.blit(self.current_image, coord)
 
 
-class Bullet:
+class BulletPool:
     WIDTH, HEIGHT = 7, 7
     DELETION_OFFSET = 500
-
-    def __init__(self, coord_x, coord_y, vector, speed=3, color=BLACK, damage=5, is_allied=False, bounce=False,
-                 pierce=False, chain=False, duration=2000, image=None, rotate=False, spin=False):
-        self.vector = vector
-        self.is_allied = is_allied
+    INITIAL_CAPACITY = 256
+    SPIN_SPEED = 10
+    DRAW_MARGIN = 50
+    COLOR = BLACK
+    BOUNCE, PIERCE, CHAIN, ROTATE, SPIN = 1, 2, 4, 8, 16
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.weapons = []
+        self.capacity = 0
+        self.position = np.zeros((0, 2))
+        self.previous_position = np.zeros((0, 2))
+        self.vector = np.zeros((0, 2))
+        self.speed = np.zeros(0)
+        self.creation_time = np.zeros(0, dtype=np.int64)
+        self.duration = np.zeros(0, dtype=np.int64)
+        self.flags = np.zeros(0, dtype=np.uint8)
+        self.weapon_id = np.zeros(0, dtype=np.int32)
+        self.bullet_id = np.zeros(0, dtype=np.int64)
+        self.spin_angle = np.zeros(0)
+        self.alive = np.zeros(0, dtype=bool)
+        self.free = []
+        self.next_bullet_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.grow(capacity)
+
+    def __len__(self):
+        return self.capacity - len(self.free)
+
+    def register(self, weapon, capacity=0):
+        self.weapons.append(weapon)
+        self.grow(self.capacity + capacity)
+        return len(self.weapons) - 1
+
+    def grow(self, capacity):
+        extra = capacity - self.capacity
+        self.position = np.concatenate((self.position, np.zeros((extra, 2))))
+        self.previous_position = np.concatenate((self.previous_position, np.zeros((extra, 2))))
+        self.vector = np.concatenate((self.vector, np.zeros((extra, 2))))
+        self.speed = np.concatenate((self.speed, np.zeros(extra)))
+        self.creation_time = np.concatenate((self.creation_time, np.zeros(extra, dtype=np.int64)))
+        self.duration = np.concatenate((self.duration, np.zeros(extra, dtype=np.int64)))
+        self.flags = np.concatenate((self.flags, np.zeros(extra, dtype=np.uint8)))
+        self.weapon_id = np.concatenate((self.weapon_id, np.zeros(extra, dtype=np.int32)))
+        self.bullet_id = np.concatenate((self.bullet_id, np.zeros(extra, dtype=np.int64)))
+        self.spin_angle = np.concatenate((self.spin_angle, np.zeros(extra)))
+        self.alive = np.concatenate((self.alive, np.zeros(extra, dtype=bool)))
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def spawn(self, coord_x, coord_y, vector, weapon, creation_time):
+        if self.free:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.grow(max(self.capacity * 2, 1))
+        idx = self.free.pop()
+        self.position[idx] = (coord_x - self.WIDTH // 2, coord_y - self.HEIGHT // 2)
+        self.previous_position[idx] = self.position[idx]
+        self.vector[idx] = (vector.x, vector.y)
+        self.speed[idx] = weapon.bullet_speed
+        self.creation_time[idx] = creation_time
+        self.duration[idx] = weapon.bullet_duration
+        self.flags[idx] = (self.BOUNCE * bool(weapon.bounce) | self.PIERCE * bool(weapon.pierce) |
+                           self.CHAIN * bool(weapon.chain) | self.ROTATE * bool(weapon.bullet_rotate) |
+                           self.SPIN * bool(weapon.bullet_spin))
+        self.weapon_id[idx] = weapon.weapon_id
+        self.bullet_id[idx] = self.next_bullet_id
+        self.spin_angle[idx] = 0
+        self.alive[idx] = True
+        self.next_bullet_id += 1
+        return idx
+
+    def release(self, indices):
+        self.alive[indices] = False
+        self.free.extend(indices)
+
+    def active_indices(self):
+        return np.flatnonzero(self.alive)
+
+    def save_previous(self):
+        np.copyto(self.previous_position, self.position)
+
+    def move(self, cam_offset, width, height):
+        active = self.active_indices()
+        if not active.size:
+            return
+        position = self.position[active]
+        vector = self.vector[active]
+        bounce = (self.flags[active] & self.BOUNCE) != 0
+        left = position[:, 0] - cam_offset[0]
+        top = position[:, 1] - cam_offset[1]
+        flip_x = bounce & (((left + self.WIDTH >= width) & (vector[:, 0] > 0)) | ((left <= 0) & (vector[:, 0] < 0)))
+        flip_y = bounce & (((top + self.HEIGHT >= height) & (vector[:, 1] > 0)) | ((top <= 0) & (vector[:, 1] < 0)))
+        vector[flip_x, 0] *= -1
+        vector[flip_y, 1] *= -1
+        self.vector[active] = vector
+        self.position[active] = position + vector * self.speed[active, None]
+
+    def cull(self, current_time, cam_offset, width, height):
+        active = self.active_indices()
+        if not active.size:
+            return
+        left = self.position[active, 0] - cam_offset[0]
+        top = self.position[active, 1] - cam_offset[1]
+        off_screen = ((self.flags[active] & self.BOUNCE) == 0) & (
+            (left + self.DELETION_OFFSET < 0) | (left + self.WIDTH - self.DELETION_OFFSET > width) |
+            (top + self.DELETION_OFFSET < 0) | (top + self.HEIGHT - self.DELETION_OFFSET > height))
+        expired = current_time - self.creation_time[active] > self.duration[active]
+        self.release(active[off_screen | expired].tolist())
+
+    def draw(self, window, cam_offset, alpha=1.0):
+        active = self.active_indices()
+        if not active.size:
+            return []
+        spinning = active[(self.flags[active] & self.SPIN) != 0]
+        spin_angles = self.spin_angle[active]
+        self.spin_angle[spinning] = (self.spin_angle[spinning] + self.SPIN_SPEED) % 360
+
+        previous = self.previous_position[active]
+        positions = previous + (self.position[active] - previous) * alpha
+        width, height = window.get_size()
+        left = positions[:, 0] - cam_offset[0]
+        top = positions[:, 1] - cam_offset[1]
+        visible = ((left > -self.DRAW_MARGIN) & (left < width + self.DRAW_MARGIN) &
+                   (top > -self.DRAW_MARGIN) & (top < height + self.DRAW_MARGIN))
+        active = active[visible]
+        positions = positions[visible]
+        spin_angles = spin_angles[visible]
+        flags = self.flags[active]
+        vector = self.vector[active]
+        angles = np.degrees(np.arctan2(-vector[:, 1], vector[:, 0]))
+
+        rects = []
+        for (x, y), weapon_id, flag, angle, spin_angle in zip(positions.tolist(), self.weapon_id[active].tolist(),
+                                                               flags.tolist(), angles.tolist(), spin_angles.tolist()):
+            image = self.weapons[weapon_id].bullet_image
+            if image is None:
+                rects.append(pygame.draw.rect(window, self.COLOR,
+                                              pygame.Rect(x - cam_offset[0], y - cam_offset[1], self.WIDTH, self.HEIGHT)))
+                continue
+            if flag & self.ROTATE:
+                image = AssetCache.rotated(image, angle)
+            elif flag & self.SPIN:
+                image = AssetCache.rotated(image, spin_angle)
+            rects.append(window.blit(image, (x - image.get_width() // 2 - cam_offset[0],
+                                             y - image.get_height() // 2 - cam_offset[1])))
+        return rects
+
+
+class GlyphCache:
+    MAX_TEXTS = 256
+
+    def __init__(self, font, color):
+        self.font = font
         self.color = color
-        self.speed = speed
-        self.bounce = bounce
-        self.damage = damage
-        self.pierce = pierce
-        self.chain = chain
-        self.duration = duration
-        self.image = image
-        self.rotate = rotate
-        self.creation_time = pygame.time.get_ticks()
-        self.spin = spin
-
-        self.spin_angle = 0
-        self.position_vector = pygame.Vector2(coord_x - self.WIDTH // 2, coord_y - self.HEIGHT // 2)
-        self.rect = pygame.Rect(coord_x, coord_y, self.WIDTH, self.HEIGHT)
+        self.glyphs = {}
+        self.texts = {}
+
+    def glyph(self, character):
+        image = self.glyphs.get(character)
+        if image is None:
+            image = self.glyphs[character] = self.font.render(character, True, self.color)
+        return image
+
+    def render(self, text):
+        image = self.texts.get(text)
+        if image is None:
+            glyphs = [self.glyph(character) for character in text]
+            image = pygame.Surface((sum(glyph.get_width() for glyph in glyphs),
+                                    max(glyph.get_height() for glyph in glyphs)), pygame.SRCALPHA)
+            coord_x = 0
+            for glyph in glyphs:
+                image.blit(glyph, (coord_x, 0))
+                coord_x += glyph.get_width()
+            if len(self.texts) >= self.MAX_TEXTS:
+                del self.texts[next(iter(self.texts))]
+            self.texts[text] = image
+        return image
+
+
+class HudText:
+    def __init__(self, font, color):
+        self.font = font
+        self.color = color
+        self.text = None
+        self.image = None
 
-    def move(self, cam_offset):
-        if self.bounce:
-            surface = pygame.display.get_surface()
-            if (self.rect.right - cam_offset[0] >= surface.get_width() and self.vector.x > 0) or (
-                    self.rect.left - cam_offset[0] <= 0 and self.vector.x < 0):
-                self.vector.x *= -1
-            if (self.rect.bottom - cam_offset[1] >= Game.HEIGHT and self.vector.y > 0) or (
-                    self.rect.top - cam_offset[1] <= 0 and self.vector.y < 0):
-                self.vector.y *= -1
-        self.position_vector.x += self.vector.x * self.speed
-        self.position_vector.y += self.vector.y * self.speed
-        self.rect.x = self.position_vector.x
-        self.rect.y = self.position_vector.y
+    def render(self, text):
+        if text != self.text:
+            self.text = text
+            self.image = self.font.render(text, True, self.color)
+        return self.image
 
-    def draw(self, window, cam_offset):
-        if self.image is None:
-            pygame.draw.rect(window, self.color, pygame.Rect(self.rect.x - cam_offset[0], self.rect.y - cam_offset[1], self.WIDTH, self.HEIGHT))
-        else:
 
-            if self.rotate:
-                img = pygame.transform.rotate(self.image, self.vector.angle_to(pygame.Vector2(1,0)))
-            elif self.spin:
-                img = pygame.transform.rotate(self.image, self.spin_angle)
-                self.spin_angle = (self.spin_angle + 10) % 360
-            else:
-                img = self.image
+class EntityList:
+    SLOT_BITS = 32
+    SLOT_MASK = (1 << SLOT_BITS) - 1
 
-            img_rect = img.get_rect()
-            img_rect.x = self.position_vector.x - img_rect.width // 2
-            img_rect.y = self.position_vector.y - img_rect.height // 2
-            window.blit(img, pygame.Rect(img_rect.x - cam_offset[0], img_rect.y - cam_offset[1],
-                                                img_rect.width, img_rect.height))
+    def __init__(self):
+        self.items = []
+        self.item_slots = []
+        self.slot_indices = []
+        self.generations = []
+        self.free_slots = []
+        self.removed = {}
+        self.iterating = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        # removals made while iterating are deferred until the outermost loop ends, so nothing is skipped
+        self.iterating += 1
+        try:
+            items = self.items
+            removed = self.removed
+            for idx in range(len(items)):
+                item = items[idx]
+                if item not in removed:
+                    yield item
+        finally:
+            self.iterating -= 1
+            if not self.iterating:
+                self.flush()
+
+    def __getitem__(self, idx):
+        return self.items[idx]
+
+    def append(self, item):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            slot = len(self.generations)
+            self.generations.append(0)
+            self.slot_indices.append(None)
+        idx = len(self.items)
+        self.slot_indices[slot] = idx
+        self.items.append(item)
+        self.item_slots.append(slot)
+        item.index = idx
+        return self.generations[slot] << self.SLOT_BITS | slot
+
+    def handle(self, item):
+        slot = self.item_slots[item.index]
+        return self.generations[slot] << self.SLOT_BITS | slot
+
+    def get(self, handle):
+        slot = handle & self.SLOT_MASK
+        if slot >= len(self.generations) or self.generations[slot] != handle >> self.SLOT_BITS:
+            return None
+        item = self.items[self.slot_indices[slot]]
+        return None if item in self.removed else item
+
+    def remove(self, item):
+        if self.iterating:
+            self.removed[item] = None
+        else:
+            self.swap_remove(item)
+
+    def flush(self):
+        removed = self.removed
+        self.removed = {}
+        for item in removed:
+            self.swap_remove(item)
+
+    def swap_remove(self, item):
+        idx = item.index
+        slot = self.item_slots[idx]
+        self.generations[slot] += 1
+        self.slot_indices[slot] = None
+        self.free_slots.append(slot)
+        last = len(self.items) - 1
+        if idx != last:
+            self.move(last, idx)
+        self.items.pop()
+        self.item_slots.pop()
+        item.index = None
+
+    def move(self, src, dst):
+        moved = self.items[src]
+        slot = self.item_slots[src]
+        self.items[dst] = moved
+        self.item_slots[dst] = slot
+        self.slot_indices[slot] = dst
+        moved.index = dst
+
+
+class ObjectPool:
+    def __init__(self, factory, capacity):
+        self.factory = factory
+        self.capacity = capacity
+        self.free = []
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, *args, **kwargs):
+        if self.free:
+            self.hits += 1
+            obj = self.free.pop()
+            obj.reset(*args, **kwargs)
+            return obj
+        self.misses += 1
+        return self.factory(*args, **kwargs)
+
+    def release(self, obj):
+        if len(self.free) < self.capacity:
+            self.free.append(obj)
 
 
 class DamageNumber:
     DURATION = 500
     FONT = pygame.font.Font(None, 40)
+    glyph_caches = {}
+    __slots__ = ('creation_time', 'image', 'rect', 'index')
 
     def __init__(self, text, coord_x, coord_y, color=WHITE):
-        self.creation_time = pygame.time.get_ticks()
-        self.image = self.FONT.render(str(text), True, color)
-        self.rect = self.image.get_rect()
+        self.creation_time = 0
+        self.image = None
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.index = None
+        self.reset(text, coord_x, coord_y, color)
+
+    def reset(self, text, coord_x, coord_y, color=WHITE):
+        glyph_cache = self.glyph_caches.get(color)
+        if glyph_cache is None:
+            glyph_cache = self.glyph_caches[color] = GlyphCache(self.FONT, color)
+        self.creation_time = CLOCK.get_ticks()
+        self.image = glyph_cache.render(str(text))
+        self.rect.size = self.image.get_size()
         self.rect.x = coord_x - self.image.get_width() // 2
         self.rect.y = coord_y - self.image.get_height() // 2
 
     def draw(self, cam_offset):
         surface = pygame.display.get_surface()
-        surface.blit(self.image, (self.rect.x - cam_offset[0], self.rect.y - cam_offset[1]))
+        return surface.blit(self.image, (self.rect.x - cam_offset[0], self.rect.y - cam_offset[1]))
 
 
-class Enemy:
-    with open("Const/enemies.json") as fd:
-        enemies = json.load(fd)
-    print(enemies)
-    with open("Const/bosses.json") as fd:
-        bosses = json.load(fd)
+class ImmunityTimers:
+    MAX_ENTRIES = 64
+    __slots__ = ('duration', 'hits')
 
+    def __init__(self, duration):
+        self.duration = duration
+        self.hits = None
+
+    def __len__(self):
+        return len(self.hits) if self.hits else 0
+
+    def expire(self, current_time):
+        hits = self.hits
+        while hits:
+            bullet_id = next(iter(hits))
+            if current_time - hits[bullet_id] <= self.duration:
+                break
+            del hits[bullet_id]
+
+    def is_immune(self, bullet_id, current_time):
+        self.expire(current_time)
+        return bool(self.hits) and bullet_id in self.hits
+
+    def clear(self):
+        if self.hits:
+            self.hits.clear()
+
+    def add(self, bullet_id, hit_time):
+        if self.hits is None:
+            self.hits = {}
+        self.hits.pop(bullet_id, None)
+        self.hits[bullet_id] = hit_time
+        if len(self.hits) > self.MAX_ENTRIES:
+            del self.hits[next(iter(self.hits))]
+
+
+class Enemy:
+    VARIANTS = 2
     ANIMATION_FRAME_DURATION = 500
     WALK_ANIMATION_FRAMES = 4
+    FACING_RIGHT, FACING_LEFT = 0, 1
     DAMAGE_TAKEN_ANIMATION_DURATION = 100
     IMMUNITY_FRAME_DURATION = 1000
+    __slots__ = ('config', 'hp', 'damage', 'rect', 'swarm', 'index', 'immunity_timers', 'walk_images',
+                 'animation_id', 'last_animation_change', 'damage_taken', 'last_damage_taken_time')
 
     def __init__(self, coord_x, coord_y, width=50, height=50, type_="Goblin", stat_multiplier=1, is_boss=False):
-        self.width = width
-        self.height = height
-        self.type_ = type_
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.immunity_timers = ImmunityTimers(self.IMMUNITY_FRAME_DURATION)
+        self.reset(coord_x, coord_y, width, height, type_, stat_multiplier, is_boss)
+
+    def reset(self, coord_x, coord_y, width=50, height=50, type_="Goblin", stat_multiplier=1, is_boss=False):
         if is_boss:
-            attributes = self.bosses[type_]
+            self.config = CONFIG.bosses[type_]
         else:
-            attributes = self.enemies[type_]
-
-        self.hp = attributes["hp"] * stat_multiplier
-        self.move_speed = attributes['move_speed']
-        self.damage = attributes['damage'] * stat_multiplier
-        self.rect = pygame.Rect(coord_x, coord_y, self.width, self.height)
-        self.position_vector = pygame.Vector2(coord_x, coord_y)
-        self.immunity_timers = {}
-        self.image = pygame.image.load(os.path.join('Assets', 'Enemy.png')).convert_alpha()
-        self.walk_images = []
-        img_path = attributes['image_path']
-        self.variant = random.randint(0, 1)
-        for img_id in range(self.WALK_ANIMATION_FRAMES):
-            if not is_boss:
-                img = pygame.image.load(f"{img_path}/Variant{self.variant}/{self.type_}_Walk_{img_id}.png").convert_alpha()
-                self.walk_images.append(img)
-            else:
-                print(self.hp)
-                img = pygame.image.load(f"{img_path}/{self.type_}_Walk_{img_id}.png").convert_alpha()
-                self.walk_images.append(img)
+            self.config = CONFIG.enemies[type_]
+
+        self.hp = self.config.hp * stat_multiplier
+        self.damage = self.config.damage * stat_multiplier
+        self.rect.update(coord_x, coord_y, width, height)
+        self.swarm = None
+        self.index = None
+        self.immunity_timers.clear()
+        variant = RNG.randint(0, self.VARIANTS - 1)
+        if is_boss:
+            self.walk_images = AssetCache.walk(self.config.image_path, type_)
+        else:
+            self.walk_images = AssetCache.walk(self.config.image_path, type_, variant)
         self.animation_id = 0
-        self.last_animation_change = pygame.time.get_ticks()
-
-        self.vector = pygame.math.Vector2()
+        self.last_animation_change = CLOCK.get_ticks()
 
         self.damage_taken = False
-        img_copy = copy.copy(self.image)
-        img_copy.fill(WHITE)
-        self.damage_taken_image = img_copy
-        self.last_damage_taken_time = pygame.time.get_ticks()
+        self.last_damage_taken_time = CLOCK.get_ticks()
 
-    def add_immunity(self, bullet):
-        hit_time = pygame.time.get_ticks()
-        self.immunity_timers.update({bullet: hit_time})
+    @property
+    def type_(self):
+        return self.config.name
 
-    def draw(self, window, cam_offset):
+    @property
+    def move_speed(self):
+        return self.config.move_speed
+
+    @property
+    def width(self):
+        return self.rect.width
+
+    @property
+    def height(self):
+        return self.rect.height
+
+    @property
+    def position_vector(self):
+        return pygame.Vector2(*self.swarm.position[self.index])
+
+    @property
+    def vector(self):
+        return pygame.Vector2(*self.swarm.vector[self.index])
+
+    def add_immunity(self, bullet_id):
+        self.immunity_timers.add(bullet_id, CLOCK.get_ticks())
+
+    def draw(self, window, cam_offset, position):
         # if self.damage_taken:
         #     window.blit(self.damage_taken_image, (self.rect.x + (Enemy.WIDTH - self.image.get_width()) // 2 - cam_offset[0],
         #                                           self.rect.y + (Enemy.HEIGHT - self.image.get_height()) // 2 - cam_offset[1]))
         # else:
         #     window.blit(self.image, (self.rect.x + (Enemy.WIDTH - self.image.get_width()) // 2 - cam_offset[0],
         #                              self.rect.y + (Enemy.HEIGHT - self.image.get_height()) // 2 - cam_offset[1]))
-        if self.vector.x < 0:
-            draw_img = pygame.transform.flip(self.walk_images[self.animation_id], flip_x=True, flip_y=False)
-        else:
-            draw_img = self.walk_images[self.animation_id]
-        window.blit(draw_img, (self.rect.x - (draw_img.get_width() - self.width) // 2 - cam_offset[0],
-                               self.rect.y - (draw_img.get_height() - self.height) // 2 - cam_offset[1]))
-        if pygame.time.get_ticks() - self.last_animation_change > self.ANIMATION_FRAME_DURATION:
-            self.animation_id = (self.animation_id + 1) % (len(self.walk_images) - 1)
-            self.last_animation_change = pygame.time.get_ticks()
-
+        facing = self.FACING_LEFT if self.swarm.vector[self.index, 0] < 0 else self.FACING_RIGHT
+        draw_img = self.walk_images[facing][self.animation_id]
+        rect = window.blit(draw_img, (int(position[0]) - (draw_img.get_width() - self.rect.width) // 2 - cam_offset[0],
+                                      int(position[1]) - (draw_img.get_height() - self.rect.height) // 2 - cam_offset[1]))
+        if CLOCK.get_ticks() - self.last_animation_change > self.ANIMATION_FRAME_DURATION:
+            self.animation_id = (self.animation_id + 1) % (len(self.walk_images[facing]) - 1)
+            self.last_animation_change = CLOCK.get_ticks()
+        return rect
 
-    def update(self, player):
-        self.vector.x = player.rect.centerx - self.position_vector.x
-        self.vector.y = player.rect.centery - self.position_vector.y
-        self.vector.normalize_ip()
-        self.vector *= self.move_speed
 
     def die(self):
         pass
 
 
+class EnemySwarm(EntityList):
+    INITIAL_CAPACITY = 256
+    CELL_STRIDE = 1 << 32
+    NEIGHBOUR_CELLS = ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1))
+    QUERY_CELLS = tuple(itertools.product((-1, 0, 1), repeat=2))
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        super().__init__()
+        self.render_order = []
+        self.cells = None
+        self.position = np.zeros((capacity, 2))
+        self.previous_position = np.zeros((capacity, 2))
+        self.vector = np.zeros((capacity, 2))
+        self.speed = np.zeros(capacity)
+        self.size = np.zeros((capacity, 2))
+
+    def append(self, enemy):
+        idx = len(self.items)
+        if idx == len(self.speed):
+            self.position = np.concatenate((self.position, np.zeros_like(self.position)))
+            self.previous_position = np.concatenate((self.previous_position, np.zeros_like(self.previous_position)))
+            self.vector = np.concatenate((self.vector, np.zeros_like(self.vector)))
+            self.speed = np.concatenate((self.speed, np.zeros_like(self.speed)))
+            self.size = np.concatenate((self.size, np.zeros_like(self.size)))
+        self.position[idx] = enemy.rect.topleft
+        self.previous_position[idx] = enemy.rect.topleft
+        self.vector[idx] = 0
+        self.speed[idx] = enemy.move_speed
+        self.size[idx] = enemy.rect.size
+        enemy.swarm = self
+        self.cells = None
+        handle = super().append(enemy)
+        self.render_order.append(handle)
+        return handle
+
+    def swap_remove(self, enemy):
+        super().swap_remove(enemy)
+        enemy.swarm = None
+        self.cells = None
+
+    def move(self, src, dst):
+        super().move(src, dst)
+        self.position[dst] = self.position[src]
+        self.previous_position[dst] = self.previous_position[src]
+        self.vector[dst] = self.vector[src]
+        self.speed[dst] = self.speed[src]
+        self.size[dst] = self.size[src]
+
+    def save_previous(self):
+        count = len(self.items)
+        self.previous_position[:count] = self.position[:count]
+
+    def interpolated_positions(self, alpha):
+        count = len(self.items)
+        previous = self.previous_position[:count]
+        return previous + (self.position[:count] - previous) * alpha
+
+    def visible_mask(self, positions, view_rect):
+        size = self.size[:len(self.items)]
+        return ((positions[:, 0] < view_rect.right) & (positions[:, 0] + size[:, 0] > view_rect.left) &
+                (positions[:, 1] < view_rect.bottom) & (positions[:, 1] + size[:, 1] > view_rect.top))
+
+    def depth_order(self, positions):
+        order = self.render_order
+        if len(order) != len(self.items):
+            # handles of dead enemies stop resolving, even when the pool has already respawned the object
+            order[:] = [handle for handle in order if self.get(handle) is not None]
+        slot_indices = self.slot_indices
+        indices = np.fromiter((slot_indices[handle & self.SLOT_MASK] for handle in order), dtype=np.intp,
+                              count=len(order))
+        coord_y = positions[indices, 1]
+        if np.any(coord_y[1:] < coord_y[:-1]):
+            # order barely changes between frames, and stable sort runs in ~O(n) on presorted input
+            permutation = np.argsort(coord_y, kind='stable')
+            order[:] = [order[idx] for idx in permutation.tolist()]
+            indices = indices[permutation]
+        return indices
+
+    def steer(self, target_x, target_y):
+        count = len(self.items)
+        offset = np.array((target_x, target_y)) - self.position[:count]
+        distance = np.hypot(offset[:, 0], offset[:, 1])
+        scale = np.divide(self.speed[:count], distance, out=np.zeros(count), where=distance != 0)
+        self.vector[:count] = offset * scale[:, None]
+
+    def cell_index(self):
+        # shared by separation and bullet collision; positions only change between the two when enemies move,
+        # spawn or die, and each of those drops the cached index
+        if self.cells is None:
+            count = len(self.items)
+            top_left = np.trunc(self.position[:count])
+            size = self.size[:count]
+            cell_size = size.max() if count else 1
+            keys = self.cell_keys(top_left, cell_size)
+            order = np.argsort(keys, kind='stable')
+            self.cells = top_left, size, cell_size, keys, order, keys[order]
+        return self.cells
+
+    def cell_keys(self, top_left, cell_size):
+        cells = np.floor_divide(top_left, cell_size).astype(np.int64)
+        return cells[:, 0] * self.CELL_STRIDE + cells[:, 1]
+
+    def cell_candidates(self, query_keys, neighbour_cells):
+        _, _, _, _, order, sorted_keys = self.cell_index()
+        for cell_x, cell_y in neighbour_cells:
+            neighbour_keys = query_keys + cell_x * self.CELL_STRIDE + cell_y
+            start = np.searchsorted(sorted_keys, neighbour_keys, side='left')
+            counts = np.searchsorted(sorted_keys, neighbour_keys, side='right') - start
+            firsts = np.repeat(np.arange(len(query_keys)), counts)
+            slots = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            yield cell_x, cell_y, firsts, order[np.repeat(start, counts) + slots]
+
+    def overlapping_pairs(self):
+        if len(self.items) < 2:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        top_left, size, _, keys, _, _ = self.cell_index()
+
+        first_parts = []
+        second_parts = []
+        for cell_x, cell_y, firsts, seconds in self.cell_candidates(keys, self.NEIGHBOUR_CELLS):
+            if cell_x == cell_y == 0:
+                keep = firsts < seconds
+                firsts, seconds = firsts[keep], seconds[keep]
+            first_parts.append(firsts)
+            second_parts.append(seconds)
+        firsts = np.concatenate(first_parts)
+        seconds = np.concatenate(second_parts)
+
+        overlap = ((top_left[firsts] < top_left[seconds] + size[seconds]) &
+                   (top_left[firsts] + size[firsts] > top_left[seconds])).all(axis=1)
+        firsts, seconds = firsts[overlap], seconds[overlap]
+        return np.minimum(firsts, seconds), np.maximum(firsts, seconds)
+
+    def overlapping_boxes(self, box_positions, box_size):
+        if not len(self.items) or not len(box_positions):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        top_left, size, cell_size, _, _, _ = self.cell_index()
+        # boxes are no larger than a cell, so an overlapping enemy starts in one of the 3x3 surrounding cells;
+        # the 1px margin keeps every hit of the truncated pygame rects in the candidate set
+        box_keys = self.cell_keys(box_positions, cell_size)
+        parts = list(self.cell_candidates(box_keys, self.QUERY_CELLS))
+        box_ids = np.concatenate([part[2] for part in parts])
+        enemy_ids = np.concatenate([part[3] for part in parts])
+        box_top_left = box_positions[box_ids]
+        overlap = ((box_top_left - 1 < top_left[enemy_ids] + size[enemy_ids]) &
+                   (box_top_left + np.add(box_size, 1) > top_left[enemy_ids])).all(axis=1)
+        box_ids, enemy_ids = box_ids[overlap], enemy_ids[overlap]
+        order = np.lexsort((enemy_ids, box_ids))
+        return box_ids[order], enemy_ids[order]
+
+    def separate(self):
+        first_ids, second_ids = self.overlapping_pairs()
+        if not first_ids.size:
+            return
+        offset = self.position[second_ids] - self.position[first_ids]
+        distance = np.hypot(offset[:, 0], offset[:, 1])
+        diagonal = (offset[:, 0] != 0) & (offset[:, 1] != 0)
+        offset = np.where(diagonal[:, None], offset / np.where(diagonal, distance, 1)[:, None], offset * 0.01)
+        np.add.at(self.position, first_ids, -offset)
+        np.add.at(self.position, second_ids, offset * 0.01)
+        self.cells = None
+
+    def integrate(self):
+        count = len(self.items)
+        self.position[:count] += self.vector[:count]
+        self.cells = None
+        for enemy, (x, y) in zip(self.items, self.position[:count].astype(np.int64).tolist()):
+            enemy.rect.x = x
+            enemy.rect.y = y
+
+    def leash(self, target_x, target_y, max_x, max_y):
+        count = len(self.items)
+        offset = np.array((target_x, target_y)) - np.trunc(self.position[:count])
+        far = (np.abs(offset[:, 0]) > max_x) | (np.abs(offset[:, 1]) > max_y)
+        if not far.any():
+            return
+        self.position[:count][far] += offset[far] * 2
+        self.previous_position[:count][far] = self.position[:count][far]
+        self.cells = None
+        # keep rects on the leashed positions so collision sees the same place the cell index does
+        for idx, (x, y) in zip(np.flatnonzero(far).tolist(), self.position[:count][far].astype(np.int64).tolist()):
+            self.items[idx].rect.topleft = (x, y)
+
+
+class FrameProfiler:
+    HISTORY = 600
+    COUNTERS = ('enemies', 'bullets', 'damage_numbers')
+    OVERLAY_FONT = pygame.font.Font(None, 22)
+    OVERLAY_REFRESH = 30
+
+    def __init__(self, stages, history=HISTORY):
+        self.stages = stages
+        self.history = history
+        self.starts = np.zeros((history, len(stages)))
+        self.durations = np.zeros((history, len(stages)))
+        self.spans = [[] for _ in range(history)]
+        self.counts = np.zeros((history, len(self.COUNTERS)), dtype=np.int64)
+        self.frame = 0
+        self.visible = False
+        self.overlay = None
+
+    def begin_frame(self):
+        row = self.frame % self.history
+        self.starts[row] = np.nan
+        self.durations[row] = 0
+        self.spans[row] = []
+
+    def run(self, game, stages):
+        row = self.frame % self.history
+        for name in stages:
+            col = self.stages.index(name)
+            start = time.perf_counter()
+            getattr(game, name)()
+            duration = time.perf_counter() - start
+            if np.isnan(self.starts[row, col]):
+                self.starts[row, col] = start
+            self.durations[row, col] += duration
+            self.spans[row].append((name, start, duration))
+
+    def end_frame(self, game):
+        row = self.frame % self.history
+        self.counts[row] = (len(game.enemies), len(game.player.bullets), len(game.damage_numbers))
+        self.frame += 1
+        if self.visible:
+            game.frame_rects.append(self.draw_overlay(game.window))
+
+    def recorded_rows(self):
+        if self.frame <= self.history:
+            return np.arange(self.frame)
+        return (np.arange(self.history) + self.frame) % self.history
+
+    def stage_durations(self):
+        rows = self.recorded_rows()
+        # stages that did not run in a frame (no steps due, or no render) are NaN rather than 0 ms samples
+        return np.where(np.isnan(self.starts[rows]), np.nan, self.durations[rows] * 1000)
+
+    def percentiles(self, *percents):
+        durations = self.stage_durations()
+        frame_durations = np.nansum(durations, axis=1, keepdims=True)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            stats = np.nanpercentile(np.hstack((durations, frame_durations)), percents, axis=0)
+        return dict(zip((*self.stages, 'frame'), stats.T.tolist()))
+
+    def draw_overlay(self, window):
+        if self.overlay is None or self.frame % self.OVERLAY_REFRESH == 0:
+            rows = [('stage', 'p50', 'p99')]
+            for stage, (p50, p99) in self.percentiles(50, 99).items():
+                rows.append((stage, *('-' if math.isnan(value) else f"{value:.2f}" for value in (p50, p99))))
+            images = [[self.OVERLAY_FONT.render(text, True, WHITE) for text in row] for row in rows]
+            counts = self.counts[(self.frame - 1) % self.history].tolist()
+            footer = self.OVERLAY_FONT.render('  '.join(f"{name}: {count}" for name, count in zip(self.COUNTERS, counts)),
+                                              True, WHITE)
+            column_widths = [max(row[col].get_width() for row in images) + 15 for col in range(3)]
+            line_height = self.OVERLAY_FONT.get_linesize()
+            self.overlay = pygame.Surface((max(sum(column_widths), footer.get_width()) + 10,
+                                           line_height * (len(images) + 1) + 10), pygame.SRCALPHA)
+            self.overlay.fill((0, 0, 0, 160))
+            for line, row in enumerate(images):
+                coord_x = 5
+                for col, image in enumerate(row):
+                    offset = 0 if col == 0 else column_widths[col] - image.get_width() - 15
+                    self.overlay.blit(image, (coord_x + offset, 5 + line * line_height))
+                    coord_x += column_widths[col]
+            self.overlay.blit(footer, (5, 5 + len(images) * line_height))
+        return window.blit(self.overlay, (10, 50))
+
+    def export(self, path):
+        rows = self.recorded_rows()
+        first_frame = self.frame - len(rows)
+        with open(path, 'w') as fd:
+            if path.endswith('.jsonl'):
+                for frame, row in enumerate(rows.tolist(), start=first_frame):
+                    ran = ~np.isnan(self.starts[row])
+                    record = {'frame': frame,
+                              'stages': dict(zip(np.array(self.stages)[ran].tolist(),
+                                                 (self.durations[row, ran] * 1000).tolist())),
+                              **dict(zip(self.COUNTERS, self.counts[row].tolist()))}
+                    fd.write(json.dumps(record) + '\n')
+            else:
+                events = []
+                for row in rows.tolist():
+                    ran = ~np.isnan(self.starts[row])
+                    if not ran.any():
+                        continue
+                    # one span per stage run, so frames with several simulation steps don't produce overlapping events
+                    for stage, start, duration in self.spans[row]:
+                        events.append({'name': stage, 'ph': 'X', 'pid': 0, 'tid': 0,
+                                       'ts': start * 1e6, 'dur': duration * 1e6})
+                    events.append({'name': 'entities', 'ph': 'C', 'pid': 0, 'tid': 0,
+                                   'ts': self.starts[row, ran].min() * 1e6,
+                                   'args': dict(zip(self.COUNTERS, self.counts[row].tolist()))})
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fd)
+
+
+class WaveScheduler:
+    ENEMY, BOSS, WAVE_END = 0, 1, 2
+
+    def __init__(self, waves, start_time=0):
+        self.waves = waves
+        self.current_wave = 0
+        self.timeline = []
+        self.sequence = itertools.count()
+        if waves:
+            self.schedule(0, start_time)
+
+    def schedule(self, wave_id, start_time):
+        wave = self.waves[wave_id]
+        end_time = start_time + wave.duration
+        events = [(end_time, self.WAVE_END, next(self.sequence), wave_id, None)]
+        if wave.boss:
+            events.append((start_time, self.BOSS, next(self.sequence), wave_id, RNG.choice(wave.boss)))
+        for enemy_type, spawnrate in zip(wave.enemies, wave.spawnrates):
+            spawn_time = start_time + spawnrate
+            while spawn_time < end_time:
+                events.append((spawn_time, self.ENEMY, next(self.sequence), wave_id, enemy_type))
+                spawn_time += spawnrate
+        self.timeline.extend(events)
+        heapq.heapify(self.timeline)
+
+    def due(self, current_time):
+        spawns = []
+        timeline = self.timeline
+        while timeline and timeline[0][0] <= current_time:
+            event = heapq.heappop(timeline)
+            if event[1] == self.WAVE_END:
+                self.current_wave = event[3] + 1
+                if self.current_wave < len(self.waves):
+                    self.schedule(self.current_wave, event[0])
+            else:
+                spawns.append(event)
+        return spawns
+
+    def finished(self):
+        return self.current_wave >= len(self.waves)
+
+
 class Game:
     WIDTH, HEIGHT = 1000, 600
-    ENEMY_SPAWN_RATE = 500
     SPAWN_BOX_SIZE = 300
     SPAWN_BOX_OFFSET = 50
     TEXT_FONT = pygame.font.Font(None, 40)
     SPAWN_LIMIT = 200
-    BULLET_DELETION_INTERVAL = 5000
     HP_BAR_WIDTH, HP_BAR_HEIGHT, HP_BAR_BORDER = 200, 50, 3
+    DAMAGE_NUMBER_POOL_CAPACITY = 256
+    LOADING_BAR_WIDTH = 400
     YOU_DIED_FONT = pygame.font.Font(None, 100)
-    GAME_DURATION = 600000
-    WAVE_DURATION = 60000
     WAVE_ADDITIONAL_STATS = 0.3
-
-    def __init__(self):
+    DRAW_MARGIN = 100
+    STEP_DURATION = 1000 / FPS
+    MAX_STEPS_PER_FRAME = 8
+    SIMULATION_STAGES = ('update_player', 'move_bullets', 'move_enemies', 'spawn_enemies', 'bullet_collision',
+                         'player_collision', 'update_bullets', 'update_damage_numbers', 'update_camera')
+    DRAW_STAGES = ('draw_background', 'draw_entities', 'draw_hud')
+    STAGES = SIMULATION_STAGES + DRAW_STAGES
+
+    def __init__(self, input_source=None, dirty_rects=False):
+        self.input = input_source if input_source is not None else LiveInput()
+        self.dirty_rects = dirty_rects
+        self.frame_rects = []
+        self.previous_frame_rects = []
+        self.full_redraw = True
+        self.render_camera = None
+        self.profiler = FrameProfiler(self.STAGES)
         self.camera_offset = pygame.math.Vector2()
+        self.previous_camera_offset = pygame.math.Vector2()
+        self.render_alpha = 1.0
         self.window = pygame.display.set_mode((self.WIDTH, self.HEIGHT))
+        AssetCache.load_all(self.draw_loading_screen)
         self.player = Player((self.WIDTH - Player.WIDTH) // 2, (self.HEIGHT - Player.HEIGHT) // 2)
         self.state = 'running'
-        self.enemies = []
-        self.last_spawn_time = pygame.time.get_ticks()
-        self.last_bullet_deletion_time = pygame.time.get_ticks()
+        self.enemies = EnemySwarm()
+        self.wave_scheduler = WaveScheduler(CONFIG.waves, CLOCK.get_ticks())
+        self.spawn_sectors = (
+            (0, self.WIDTH, -self.SPAWN_BOX_SIZE, -self.SPAWN_BOX_OFFSET),
+            (-self.SPAWN_BOX_SIZE, -self.SPAWN_BOX_OFFSET, 0, self.HEIGHT),
+            (self.WIDTH + self.SPAWN_BOX_OFFSET, self.WIDTH + self.SPAWN_BOX_SIZE, 0, self.HEIGHT),
+            (0, self.WIDTH, self.HEIGHT + self.SPAWN_BOX_OFFSET, self.HEIGHT + self.SPAWN_BOX_SIZE),
+        )
         self.game_over_surface = pygame.Surface((self.WIDTH, self.HEIGHT))
         self.game_over_surface.fill(BLACK)
         self.game_over_surface_alpha = 1
         self.game_over_surface_alpha_max = 200
         self.game_over_text_alpha = 1
         self.game_over_animation = False
-        self.damage_numbers = []
-        self.tiles = []
-        tileset_image = pygame.image.load('Assets/Tile_grass.png')
-        self.create_tileset(tileset_image)
+        self.damage_numbers = EntityList()
+        self.damage_number_pool = ObjectPool(DamageNumber, self.DAMAGE_NUMBER_POOL_CAPACITY)
+        self.enemy_pools = {(config.is_boss, name): ObjectPool(Enemy, config.pool_capacity)
+                            for name, config in (*CONFIG.enemies.items(), *CONFIG.bosses.items())}
+        self.kills_text = HudText(self.TEXT_FONT, BLACK)
+        self.timer_text = HudText(self.TEXT_FONT, BLACK)
+        self.tile_size = (0, 0)
+        self.background = None
+        self.create_background(AssetCache.image('Assets/Tile_grass.png'))
+        self.update_camera()
+        self.previous_camera_offset = pygame.math.Vector2(self.camera_offset)
 
         self.current_time = 0
-        self.current_wave = 0
+
+    def draw_loading_screen(self, loaded, total):
+        pygame.event.pump()
+        self.window.fill(BLACK)
+        loading_bar_border_rect = pygame.Rect((self.WIDTH - self.LOADING_BAR_WIDTH) // 2, (self.HEIGHT - self.HP_BAR_HEIGHT) // 2,
+                                              self.LOADING_BAR_WIDTH, self.HP_BAR_HEIGHT)
+        loading_bar_rect = loading_bar_border_rect.inflate(-self.HP_BAR_BORDER * 2, -self.HP_BAR_BORDER * 2)
+        loading_bar_rect.width = loading_bar_rect.width * loaded // total
+        pygame.draw.rect(self.window, WHITE, rect=loading_bar_border_rect, width=self.HP_BAR_BORDER)
+        pygame.draw.rect(self.window, WHITE, rect=loading_bar_rect)
+        loading_text = self.TEXT_FONT.render(f"Loading assets {loaded}/{total}", True, WHITE)
+        self.window.blit(loading_text, ((self.WIDTH - loading_text.get_width()) // 2, loading_bar_border_rect.top - 40))
+        pygame.display.update()
 
     def draw_hp_bar(self):
         hp_bar_border_rect = pygame.Rect(self.WIDTH - self.HP_BAR_WIDTH - 10, 10,
@@ -329,114 +1494,123 @@ class Game:
                                   (self.HP_BAR_WIDTH - self.HP_BAR_BORDER * 2) * current_hp_percentage, self.HP_BAR_HEIGHT - self.HP_BAR_BORDER * 2)
         pygame.draw.rect(self.window, BLACK, rect=hp_bar_border_rect, width=self.HP_BAR_BORDER)
         pygame.draw.rect(self.window, RED, rect=hp_bar_rect)
+        return hp_bar_border_rect
 
     def draw(self):
-        half_width = self.window.get_width() // 2
-        half_height = self.window.get_height() // 2
-        self.camera_offset = pygame.math.Vector2(self.player.rect.centerx - half_width, self.player.rect.centery - half_height)
-        # self.window.fill(WHITE)
-        self.draw_background()
-        self.player.draw(self.window, self.camera_offset)
-
-        def get_coord_y(obj):
-            return obj.position_vector.y
-        self.enemies.sort(key=get_coord_y)
-
-        for enemy in self.enemies:
-            enemy.draw(self.window, self.camera_offset)
-
-        for weapon in self.player.weapons:
-            for bullet in weapon.bullets:
-                bullet.draw(self.window, self.camera_offset)
-
+        for name in self.DRAW_STAGES:
+            getattr(self, name)()
+
+    def view_rect(self):
+        return pygame.Rect(int(self.render_camera.x), int(self.render_camera.y), self.WIDTH, self.HEIGHT)
+
+    def draw_entities(self):
+        cam_offset = self.render_camera
+        rects = self.frame_rects
+        rects.extend(self.player.draw(self.window, self.camera_offset))
+
+        view_rect = self.view_rect()
+        positions = self.enemies.interpolated_positions(self.render_alpha)
+        order = self.enemies.depth_order(positions)
+        order = order[self.enemies.visible_mask(positions, view_rect.inflate(self.DRAW_MARGIN * 2, self.DRAW_MARGIN * 2))[order]]
+        positions = positions.tolist()
+        for idx in order.tolist():
+            rects.append(self.enemies[idx].draw(self.window, cam_offset, positions[idx]))
+
+        rects.extend(self.player.bullets.draw(self.window, cam_offset, self.render_alpha))
+
+    def draw_hud(self):
+        rects = self.frame_rects
+        view_rect = self.view_rect()
         for damage_num in self.damage_numbers:
-            damage_num.draw(self.camera_offset)
+            if damage_num.rect.colliderect(view_rect):
+                rects.append(damage_num.draw(self.render_camera))
 
-        kills = self.TEXT_FONT.render(f"Kills: {self.player.kills}", True, BLACK)
-        self.window.blit(kills, (10, 10))
-        self.draw_hp_bar()
-        self.draw_timer()
+        kills = self.kills_text.render(f"Kills: {self.player.kills}")
+        rects.append(self.window.blit(kills, (10, 10)))
+        rects.append(self.draw_hp_bar())
+        rects.append(self.draw_timer())
+
+    def update_display(self):
+        if not self.dirty_rects or self.full_redraw:
+            pygame.display.update()
+        else:
+            pygame.display.update(self.previous_frame_rects + self.frame_rects)
+        self.previous_frame_rects, self.frame_rects = self.frame_rects, []
+        self.full_redraw = False
+
+    def advance(self, steps, alpha=1.0, render=True):
+        self.profiler.begin_frame()
+        for _ in range(steps):
+            CLOCK.tick()
+            self.previous_camera_offset = pygame.math.Vector2(self.camera_offset)
+            self.enemies.save_previous()
+            self.player.bullets.save_previous()
+            self.profiler.run(self, self.SIMULATION_STAGES)
+        self.render_alpha = alpha
+        if render:
+            self.profiler.run(self, self.DRAW_STAGES)
+        self.profiler.end_frame(self)
+
+    def update_camera(self):
+        self.camera_offset = pygame.math.Vector2(self.player.rect.centerx - self.WIDTH // 2,
+                                                 self.player.rect.centery - self.HEIGHT // 2)
+
+    def update_player(self):
+        self.player.current_weapon.update_position(self.player.rect.centerx, self.player.rect.centery,
+                                                   self.camera_offset, self.input.get_mouse_pos())
+        self.player.input(self.input.get_pressed())
 
     def move_bullets(self):
-        for weapon in self.player.weapons:
-            for bullet in weapon.bullets:
-                bullet.move(self.camera_offset)
+        self.player.bullets.move(self.camera_offset, self.WIDTH, self.HEIGHT)
 
     def move_enemies(self):
-        for enemy_id, enemy in enumerate(self.enemies):
-            if pygame.time.get_ticks() - enemy.last_damage_taken_time > Enemy.DAMAGE_TAKEN_ANIMATION_DURATION:
+        current_time = CLOCK.get_ticks()
+        for enemy in self.enemies:
+            if current_time - enemy.last_damage_taken_time > Enemy.DAMAGE_TAKEN_ANIMATION_DURATION:
                 enemy.damage_taken = False
-            enemy.update(self.player)
-
-            for second_enemy in self.enemies[enemy_id:]:
-                if enemy.rect.colliderect(second_enemy.rect) and second_enemy != enemy:
-                    first_vector = second_enemy.position_vector - enemy.position_vector
-                    if first_vector.x != 0 and first_vector.y != 0:
-                        first_vector.normalize_ip()
-                    else:
-                        first_vector *= 0.01
-                    second_vector = -first_vector
-                    enemy.position_vector += second_vector
-                    second_enemy.position_vector += first_vector * 0.01
-
-            enemy.position_vector.x += enemy.vector.x
-            enemy.position_vector.y += enemy.vector.y
-            enemy.rect.x = enemy.position_vector.x
-            enemy.rect.y = enemy.position_vector.y
-
-            vector_to_player = pygame.Vector2(self.player.rect.x - enemy.rect.x, self.player.rect.y - enemy.rect.y)
-            if abs(vector_to_player.x) > self.WIDTH * 0.8 or abs(vector_to_player.y) > self.HEIGHT * 0.8:
-                enemy.position_vector += vector_to_player * 2
-
-    def spawn_boss(self, coord_x, coord_y):
-        with open("Const/bosses.json") as fd:
-            bosses = json.load(fd)
-        boss_type = random.choice(list(bosses.keys()))
-        stat_multiplier = 1 + self.WAVE_ADDITIONAL_STATS * self.current_wave / 2
-        boss = Enemy(coord_x, coord_y, type_=boss_type, height=150, width=150, stat_multiplier=stat_multiplier, is_boss=True)
+        self.enemies.steer(self.player.rect.centerx, self.player.rect.centery)
+        self.enemies.separate()
+        self.enemies.integrate()
+        self.enemies.leash(self.player.rect.x, self.player.rect.y, self.WIDTH * 0.8, self.HEIGHT * 0.8)
+
+    def spawn_boss(self, coord_x, coord_y, boss_type=None, wave_id=0):
+        if boss_type is None:
+            boss_type = RNG.choice(CONFIG.boss_types)
+        stat_multiplier = 1 + self.WAVE_ADDITIONAL_STATS * max(wave_id - 1, 0) / 2
+        boss = self.enemy_pools[True, boss_type].acquire(coord_x, coord_y, type_=boss_type, height=150, width=150,
+                                                   stat_multiplier=stat_multiplier, is_boss=True)
         self.enemies.append(boss)
 
-    def create_enemy(self, coord_x, coord_y):
-        if self.current_time // 60000 > self.current_wave:
-            self.spawn_boss(coord_x, coord_y)
-            self.current_wave += 1
-
-        with open("Const/enemies.json") as fd:
-            enemies = json.load(fd)
-        enemy_type = random.choice(list(enemies.keys()))
-
-        stat_multiplier = 1 + self.WAVE_ADDITIONAL_STATS * self.current_wave
-        enemy = Enemy(coord_x, coord_y, type_=enemy_type, stat_multiplier=stat_multiplier)
+    def create_enemy(self, coord_x, coord_y, enemy_type=None, wave_id=0):
+        if enemy_type is None:
+            enemy_type = RNG.choice(CONFIG.enemy_types)
+        stat_multiplier = 1 + self.WAVE_ADDITIONAL_STATS * wave_id
+        enemy = self.enemy_pools[False, enemy_type].acquire(coord_x, coord_y, type_=enemy_type, stat_multiplier=stat_multiplier)
         self.enemies.append(enemy)
-        self.current_time = pygame.time.get_ticks()
+
+    def spawn_position(self):
+        min_x, max_x, min_y, max_y = RNG.choice(self.spawn_sectors)
+        return (RNG.randint(min_x, max_x) + self.camera_offset[0],
+                RNG.randint(min_y, max_y) + self.camera_offset[1])
 
     def spawn_enemies(self):
-        if pygame.time.get_ticks() - self.last_spawn_time > self.ENEMY_SPAWN_RATE and len(self.enemies) <= self.SPAWN_LIMIT:
-            self.last_spawn_time = pygame.time.get_ticks()
-            spawn_sector = random.choice(['left', 'right', 'top', 'bottom'])
-            if spawn_sector == 'top':
-                spawn_coord = (random.randint(0, self.WIDTH) + self.camera_offset[0],
-                               random.randint(-self.SPAWN_BOX_SIZE, -self.SPAWN_BOX_OFFSET) + self.camera_offset[1])
-            elif spawn_sector == 'left':
-                spawn_coord = (random.randint(-self.SPAWN_BOX_SIZE, -self.SPAWN_BOX_OFFSET) + self.camera_offset[0],
-                               random.randint(0, self.HEIGHT) + self.camera_offset[1])
-            elif spawn_sector == 'right':
-                spawn_coord = (random.randint(self.WIDTH + self.SPAWN_BOX_OFFSET, self.WIDTH + self.SPAWN_BOX_SIZE) + self.camera_offset[0],
-                               random.randint(0, self.HEIGHT) + + self.camera_offset[1])
-            elif spawn_sector == 'bottom':
-                spawn_coord = (random.randint(0, self.WIDTH) + self.camera_offset[0],
-                               random.randint(self.HEIGHT + self.SPAWN_BOX_OFFSET, self.HEIGHT + self.SPAWN_BOX_SIZE) + self.camera_offset[1])
-            self.create_enemy(spawn_coord[0], spawn_coord[1])
+        for _, kind, _, wave_id, type_ in self.wave_scheduler.due(CLOCK.get_ticks()):
+            if kind == WaveScheduler.BOSS:
+                self.spawn_boss(*self.spawn_position(), type_, wave_id)
+            elif len(self.enemies) <= self.SPAWN_LIMIT:
+                self.create_enemy(*self.spawn_position(), type_, wave_id)
 
     def event_handler(self):
-        if self.player.current_hp <= 0 or self.current_wave == 10:
+        if self.player.current_hp <= 0 or self.wave_scheduler.finished():
             self.state = 'game_over'
-        for event in pygame.event.get():
+        for event in self.input.get_events():
             if event.type == pygame.QUIT:
                 self.state = 'quit'
             if self.state != 'game_over':
                 if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_p:
+                    if event.key == pygame.K_F3:
+                        self.profiler.visible = not self.profiler.visible
+                    elif event.key == pygame.K_p:
                         self.state = 'paused'
                     else:
                         self.state = 'running'
@@ -451,66 +1625,79 @@ class Game:
                     self.player.current_weapon = self.player.weapons[curr_weapon_idx - 1]
 
     def bullet_collision(self):
-        for weapon in self.player.weapons:
-            for bullet in weapon.bullets:
-                for enemy in self.enemies:
-                    if bullet.rect.colliderect(enemy.rect):
-                        current_time = pygame.time.get_ticks()
-                        if bullet not in enemy.immunity_timers.keys() or \
-                                current_time - enemy.immunity_timers[bullet] > enemy.IMMUNITY_FRAME_DURATION:
-                            self.damage_numbers.append(DamageNumber(bullet.damage, bullet.rect.x, bullet.rect.y))
-                            if weapon.lifesteal:
-                                heal = weapon.damage * weapon.lifesteal
-                                if self.player.current_hp + heal <= self.player.max_hp:
-                                    self.player.current_hp = self.player.current_hp + heal
-                                    heal_number = DamageNumber(f"+{int(heal)}", self.player.rect.x, self.player.rect.y, color=RED)
-                                    self.damage_numbers.append(heal_number)
-                            enemy.damage_taken = True
-                            enemy.last_damage_taken_time = pygame.time.get_ticks()
-                            enemy.add_immunity(bullet)
-                            enemy.hp -= bullet.damage
-                            if enemy.hp <= 0:
-                                enemy.die()
-                                self.player.kills += 1
-                                self.enemies.remove(enemy)
-                            if bullet.chain:
-                                bullet.vector = -bullet.vector
-                            elif not bullet.pierce:
-                                if bullet in weapon.bullets:
-                                    weapon.bullets.remove(bullet)
+        bullets = self.player.bullets
+        enemies = self.enemies.items[:]
+        spent_bullets = []
+        active = bullets.active_indices()
+        box_ids, enemy_ids = self.enemies.overlapping_boxes(bullets.position[active], (bullets.WIDTH, bullets.HEIGHT))
+        box_ids, starts = np.unique(box_ids, return_index=True)
+        candidates = np.split(enemy_ids, starts[1:])
+        active = active[box_ids]
+        for idx, (x, y), weapon_id, flags, bullet_id, enemy_ids in zip(active.tolist(), bullets.position[active].tolist(),
+                                                                      bullets.weapon_id[active].tolist(),
+                                                                      bullets.flags[active].tolist(),
+                                                                      bullets.bullet_id[active].tolist(), candidates):
+            weapon = bullets.weapons[weapon_id]
+            bullet_rect = pygame.Rect(x, y, bullets.WIDTH, bullets.HEIGHT)
+            for enemy in map(enemies.__getitem__, enemy_ids.tolist()):
+                if enemy.swarm is None or not bullet_rect.colliderect(enemy.rect):
+                    continue
+                current_time = CLOCK.get_ticks()
+                if not enemy.immunity_timers.is_immune(bullet_id, current_time):
+                    self.add_damage_number(weapon.damage, bullet_rect.x, bullet_rect.y)
+                    if weapon.lifesteal:
+                        heal = weapon.damage * weapon.lifesteal
+                        if self.player.current_hp + heal <= self.player.max_hp:
+                            self.player.current_hp = self.player.current_hp + heal
+                            self.add_damage_number(f"+{int(heal)}", self.player.rect.x, self.player.rect.y, color=RED)
+                    enemy.damage_taken = True
+                    enemy.last_damage_taken_time = CLOCK.get_ticks()
+                    enemy.add_immunity(bullet_id)
+                    enemy.hp -= weapon.damage
+                    weapon.damage_dealt += weapon.damage
+                    if enemy.hp <= 0:
+                        enemy.die()
+                        self.player.kills += 1
+                        self.enemies.remove(enemy)
+                        self.enemy_pools[enemy.config.is_boss, enemy.type_].release(enemy)
+                    if flags & bullets.CHAIN:
+                        bullets.vector[idx] *= -1
+                    elif not flags & bullets.PIERCE:
+                        spent_bullets.append(idx)
+                        break
+        bullets.release(spent_bullets)
+
+    def add_damage_number(self, text, coord_x, coord_y, color=WHITE):
+        self.damage_numbers.append(self.damage_number_pool.acquire(text, coord_x, coord_y, color))
 
     def update_damage_numbers(self):
+        current_time = CLOCK.get_ticks()
         for dmg_number in self.damage_numbers:
             dmg_number.rect.y -= 1
-            if pygame.time.get_ticks() - dmg_number.creation_time > DamageNumber.DURATION:
+            if current_time - dmg_number.creation_time > DamageNumber.DURATION:
                 self.damage_numbers.remove(dmg_number)
+                self.damage_number_pool.release(dmg_number)
+
+    def pool_stats(self):
+        stats = {'bullets': (self.player.bullets.hits, self.player.bullets.misses),
+                 'damage numbers': (self.damage_number_pool.hits, self.damage_number_pool.misses)}
+        for (is_boss, name), pool in self.enemy_pools.items():
+            stats[f"{name} (boss)" if is_boss else name] = (pool.hits, pool.misses)
+        return stats
 
     def player_collision(self):
-        if pygame.time.get_ticks() - self.player.last_damage_taken_time > Player.IMMUNITY_FRAME_DURATION:
-            self.player.last_damage_taken_time = pygame.time.get_ticks()
+        if CLOCK.get_ticks() - self.player.last_damage_taken_time > Player.IMMUNITY_FRAME_DURATION:
+            self.player.last_damage_taken_time = CLOCK.get_ticks()
             for enemy in self.enemies:
                 if self.player.rect.colliderect(enemy.rect):
                     self.player.current_hp -= enemy.damage
 
     def update_bullets(self):
-        if self.last_bullet_deletion_time >= self.BULLET_DELETION_INTERVAL:
-            for weapon in self.player.weapons:
-                for bullet in weapon.bullets:
-                    if not bullet.bounce:
-                        if bullet.rect.left + bullet.DELETION_OFFSET - self.camera_offset[0] < 0 or \
-                                bullet.rect.right - bullet.DELETION_OFFSET - self.camera_offset[0] > Game.WIDTH or \
-                                bullet.rect.top + bullet.DELETION_OFFSET - self.camera_offset[1] < 0 or \
-                                bullet.rect.bottom - bullet.DELETION_OFFSET - self.camera_offset[1] > Game.HEIGHT:
-                            if bullet in weapon.bullets:
-                                weapon.bullets.remove(bullet)
-        for weapon in self.player.weapons:
-            for bullet in weapon.bullets:
-                if pygame.time.get_ticks() - bullet.creation_time > bullet.duration:
-                    if bullet in weapon.bullets:
-                        weapon.bullets.remove(bullet)
+        self.player.bullets.cull(CLOCK.get_ticks(), self.camera_offset, self.WIDTH, self.HEIGHT)
 
     def draw_game_over(self):
         self.draw()
+        self.full_redraw = True
         if self.game_over_surface_alpha <= self.game_over_surface_alpha_max:
             self.game_over_surface.set_alpha(self.game_over_surface_alpha)
             self.game_over_surface_alpha += 1
@@ -524,34 +1711,25 @@ class Game:
             self.game_over_animation = False
         self.window.blit(you_died_text, ((self.WIDTH - you_died_text.get_width()) / 2, (self.HEIGHT - you_died_text.get_height()) / 2))
 
-    def create_tileset(self, image):
-        self.tiles = []
-        img_height = image.get_height()
-        img_width = image.get_width()
-        full_width = self.WIDTH + 2 * img_width
-        full_height = self.HEIGHT + 2 * img_height
-
-        tile_x = 0
-        tile_y = 0
-        print(full_width, full_height)
-
-        while tile_x <= full_width:
-            while tile_y <= full_height:
-                print(tile_x, tile_y)
-                tile = Tile(tile_x, tile_y, image)
-                self.tiles.append(tile)
-                tile_y += img_height
-            tile_y = 0
-            tile_x += img_width
-        print([tile.rect for tile in self.tiles])
+    def create_background(self, image):
+        img_width, img_height = image.get_size()
+        self.tile_size = (img_width, img_height)
+        self.background = pygame.Surface((self.WIDTH + img_width, self.HEIGHT + img_height)).convert()
+        for tile_x in range(0, self.background.get_width(), img_width):
+            for tile_y in range(0, self.background.get_height(), img_height):
+                self.background.blit(image, (tile_x, tile_y))
 
     def draw_background(self):
-        for tile in self.tiles:
-            tile_offset = pygame.math.Vector2(self.camera_offset.x % tile.rect.width, self.camera_offset.y % tile.rect.height)
-            self.window.blit(tile.image, (tile.rect.x - tile_offset.x, tile.rect.y - tile_offset.y))
+        cam_offset = self.previous_camera_offset.lerp(self.camera_offset, self.render_alpha)
+        if cam_offset != self.render_camera:
+            self.render_camera = cam_offset
+            self.full_redraw = True
+        self.frame_rects = []
+        # self.window.fill(WHITE)
+        self.window.blit(self.background, (-(cam_offset.x % self.tile_size[0]), -(cam_offset.y % self.tile_size[1])))
 
     def draw_timer(self):
-        self.current_time = pygame.time.get_ticks()
+        self.current_time = CLOCK.get_ticks()
         minutes = (self.current_time // 1000) // 60
         seconds = (self.current_time // 1000) % 60
         if minutes == 0:
@@ -559,45 +1737,95 @@ class Game:
         if seconds < 10:
             seconds = f"0{seconds}"
 
-        time_text = self.TEXT_FONT.render(f"{minutes}:{seconds}", True, BLACK)
-        self.window.blit(time_text, (self.WIDTH // 2 - time_text.get_width() // 2, 10))
-
-
-class Tile:
-    def __init__(self, coord_x, coord_y, image):
-        self.rect = pygame.Rect(coord_x, coord_y, image.get_width(), image.get_height())
-        self.image = image
+        time_text = self.timer_text.render(f"{minutes}:{seconds}")
+        return self.window.blit(time_text, (self.WIDTH // 2 - time_text.get_width() // 2, 10))
 
 
-def main():
-    clock = pygame.time.Clock()
-    game = Game()
-    while game.state != 'quit':
-        clock.tick(FPS)
+def run(game, clock, frames=None, render_every=1):
+    frame = 0
+    accumulator = 0
+    while game.state != 'quit' and (frames is None or frame < frames):
+        accumulator += clock.tick(FPS / render_every)
+        game.input.next_frame(game)
         game.event_handler()
         if game.state == 'running':
-            game.player.current_weapon.update_position(game.player.rect.centerx, game.player.rect.centery, game.camera_offset)
-            game.player.input()
-            game.move_bullets()
-            game.move_enemies()
-            game.spawn_enemies()
-            game.bullet_collision()
-            game.player_collision()
-            game.update_bullets()
-            game.update_damage_numbers()
-            game.draw()
-        elif game.state == 'game_over':
-            game.draw_game_over()
-            if not game.game_over_animation:
-                keys_pressed = pygame.key.get_pressed()
-                mouse_buttons_pressed = pygame.mouse.get_pressed()
+            steps = 0
+            while accumulator >= game.STEP_DURATION - 1e-6 and steps < game.MAX_STEPS_PER_FRAME:
+                accumulator -= game.STEP_DURATION
+                steps += 1
+            if steps == game.MAX_STEPS_PER_FRAME:
+                accumulator = min(accumulator, game.STEP_DURATION)
+            game.advance(steps, max(0.0, min(1.0, accumulator / game.STEP_DURATION)))
+            game.update_display()
+        else:
+            accumulator = 0
+            game.full_redraw = True
+        if game.state == 'game_over':
+            if game.game_over_animation or game.game_over_text_alpha < 255:
+                game.draw_game_over()
+                game.update_display()
+            else:
+                keys_pressed = game.input.get_pressed()
+                mouse_buttons_pressed = game.input.get_mouse_pressed()
                 if keys_pressed or mouse_buttons_pressed:
                     game.state = 'main_menu'
         elif game.state == 'main_menu':
             pass
-        pygame.display.update()
+        frame += 1
         # print(game.state)
-    pygame.quit()
 
 
-main()
+def main(headless=False, frames=None, seed=None, trace=None, render_every=1, dirty_rects=False, record=None,
+         replay=None):
+    if replay:
+        replay_input = ReplayInput(replay)
+        seed = replay_input.seed
+    elif record and seed is None:
+        seed = random.randrange(1 << 62)
+    RNG.seed(seed)
+    set_clock(VirtualClock(Game.STEP_DURATION))
+    if headless:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    if replay:
+        frame_clock = replay_input
+        game = Game(replay_input, dirty_rects)
+        frames = len(replay_input) if frames is None else min(frames, len(replay_input))
+    elif headless:
+        frame_clock = VirtualClock(Game.STEP_DURATION)
+        game = Game(ScriptedInput(), dirty_rects)
+        if frames is None:
+            frames = int(sum(wave.duration for wave in CONFIG.waves) * FPS // 1000 // render_every)
+    else:
+        frame_clock = RealClock()
+        game = Game(dirty_rects=dirty_rects)
+    if record:
+        game.input = frame_clock = InputRecorder(game.input, frame_clock, record, seed)
+    try:
+        run(game, frame_clock, frames, render_every)
+    finally:
+        if record:
+            # flush the buffered tail even when the session crashes or is interrupted
+            game.input.close()
+    if trace:
+        game.profiler.export(trace)
+    pygame.quit()
+    return game
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--headless', action='store_true', help='run with the dummy video driver and a virtual clock')
+    parser.add_argument('--frames', type=int, help='stop after this many rendered frames')
+    parser.add_argument('--seed', type=int, help='seed for the game RNG')
+    parser.add_argument('--trace', help='write profiler data on exit (Chrome trace JSON, or JSON lines for .jsonl)')
+    parser.add_argument('--render-every', type=int, default=1, metavar='N',
+                        help='render once every N simulation steps (for slow machines)')
+    parser.add_argument('--dirty-rects', action='store_true',
+                        help='push only the changed screen regions to the display while the camera is still')
+    parser.add_argument('--record', metavar='PATH', help='record per-frame input, frame timing and the seed to a file')
+    parser.add_argument('--replay', metavar='PATH', help='replay a recording as fast as possible instead of reading input')
+    args = parser.parse_args()
+    main(args.headless, args.frames, args.seed, args.trace, args.render_every, args.dirty_rects, args.record,
+         args.replay)